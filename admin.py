@@ -0,0 +1,202 @@
+"""
+Embedded admin server for a running BotSocket. Runs in the event loop of the bot:
+
+    bot = BotSocket(access_token=access_token, admin=AdminServer(port=8081, context=dict(api=api)))
+
+Endpoints:
+    GET    /health/live         200 as long as the event loop is responsive
+    GET    /health/ready        200 if the bot is connected to the websocket (or is a standby instance), else 503
+    GET    /status              connection state, queue depths, pool use, cache hit ratios, circuit breakers, ...
+    GET    /commands            registered commands
+    POST   /commands            add a command: {"command": "/joke", "help": "...", "callback": "asyncdemobot:get_joke"}
+                                optional: "bind": ["api"] to pass objects from the context as leading arguments and
+                                any other Command field (timeout, fallback, coalesce, per_room, arguments, cost)
+    DELETE /commands?command=/x remove a command; the command of the default action can't be removed
+    GET    /commands/in-flight  commands currently being executed
+    GET    /commands/slowest    slowest recently executed commands; ?n=10
+    PUT    /pool                resize the thread pool: {"max_workers": 8}
+
+The server only listens on localhost by default and all endpoints except the health checks require the token (if set)
+as bearer token. The endpoints changing the bot (POST and DELETE /commands, PUT /pool) are only available if a token
+is set, and callbacks can only be imported from the modules given as `modules`.
+"""
+import functools
+import importlib
+import logging
+
+from aiohttp import web
+from typing import Optional, Dict, Any, Callable, Sequence
+
+log = logging.getLogger(__name__)
+
+# Command fields which can be set when adding a command: name -> (type, None allowed)
+COMMAND_OPTIONS = dict(arguments=(str, True), coalesce=(float, False), per_room=(bool, False), timeout=(float, True),
+                       fallback=(str, True), cost=(int, False))
+
+# modules callbacks of commands added through the admin API can be imported from by default
+CALLBACK_MODULES = ('asyncdemobot', 'demobot')
+
+
+def import_callback(path: str, modules: Sequence[str] = CALLBACK_MODULES) -> Callable:
+    """
+    Resolve a callback given as "module:attribute", example "asyncdemobot:get_joke"
+    :param path: import path
+    :param modules: modules callbacks can be imported from
+    :return: callable
+    """
+    module_name, _, attribute = path.partition(':')
+    if not module_name or not attribute:
+        raise ValueError(f'callback has to be given as "module:attribute", not "{path}"')
+    if module_name not in modules:
+        raise ValueError(f'callbacks can only be imported from {", ".join(modules)}, not from {module_name}')
+    obj = importlib.import_module(module_name)
+    for name in attribute.split('.'):
+        obj = getattr(obj, name)
+    if not callable(obj):
+        raise ValueError(f'{path} is not callable')
+    return obj
+
+
+def command_options(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get the Command fields given in the JSON body of a request to add a command
+    :param data: JSON body
+    :return: options to pass to add_command()
+    """
+    options = {}
+    for name, (option_type, optional) in COMMAND_OPTIONS.items():
+        if name not in data:
+            continue
+        value = data[name]
+        if option_type is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        # bool is a subclass of int but true/false is no valid number
+        valid = isinstance(value, option_type) and (option_type is bool or not isinstance(value, bool))
+        if not valid and not (value is None and optional):
+            raise TypeError(f'{name} has to be of type {option_type.__name__}, not {type(value).__name__}')
+        options[name] = value
+    return options
+
+
+class AdminServer:
+    """
+    Admin and health HTTP endpoint for a BotSocket
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8081, token: Optional[str] = None,
+                 context: Optional[Dict[str, Any]] = None, modules: Sequence[str] = CALLBACK_MODULES) -> None:
+        """
+        :param host: address to listen on
+        :param port: port to listen on
+        :param token: bearer token required for all endpoints except the health checks. Without token the bot can't be
+            changed through the admin API
+        :param context: objects which can be bound to callbacks of commands added through the admin API
+        :param modules: modules callbacks of commands added through the admin API can be imported from
+        """
+        self._host = host
+        self._port = port
+        self._token = token
+        self._context = context if context is not None else {}
+        self._modules = tuple(modules)
+        self._bot = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, bot) -> None:
+        """
+        Start serving; has to be called in the event loop of the bot
+        :param bot: BotSocket instance
+        """
+        self._bot = bot
+        app = web.Application(middlewares=[self._authorize])
+        app.router.add_get('/health/live', self._live)
+        app.router.add_get('/health/ready', self._ready)
+        app.router.add_get('/status', self._status)
+        app.router.add_get('/commands', self._get_commands)
+        app.router.add_get('/commands/in-flight', self._in_flight)
+        app.router.add_get('/commands/slowest', self._slowest)
+        if self._token:
+            app.router.add_post('/commands', self._add_command)
+            app.router.add_delete('/commands', self._remove_command)
+            app.router.add_put('/pool', self._resize_pool)
+        else:
+            log.warning('admin server: no token set; changing commands and the pool is disabled')
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host=self._host, port=self._port)
+        await site.start()
+        log.info('admin server listening on %s:%s', self._host, self.port)
+
+    @property
+    def port(self) -> int:
+        """
+        port the server listens on; useful if started on port 0
+        """
+        return self._runner.addresses[0][1] if self._runner else self._port
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @web.middleware
+    async def _authorize(self, request: web.Request, handler) -> web.StreamResponse:
+        if self._token and not request.path.startswith('/health/') and \
+                request.headers.get('Authorization') != f'Bearer {self._token}':
+            return web.json_response(dict(error='unauthorized'), status=401)
+        return await handler(request)
+
+    async def _live(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(status='ok'))
+
+    async def _ready(self, request: web.Request) -> web.Response:
+        state = self._bot.connection_state
+        return web.json_response(dict(ready=self._bot.ready, state=state), status=200 if self._bot.ready else 503)
+
+    async def _status(self, request: web.Request) -> web.Response:
+        return web.json_response(self._bot.status())
+
+    async def _get_commands(self, request: web.Request) -> web.Response:
+        return web.json_response(self._bot.describe_commands())
+
+    async def _add_command(self, request: web.Request) -> web.Response:
+        try:
+            data = await request.json()
+            callback = import_callback(data['callback'], self._modules)
+            bind = [self._context[name] for name in data.get('bind', [])]
+            if bind:
+                callback = functools.partial(callback, *bind)
+            self._bot.add_command(data['command'], data['help'], callback, **command_options(data))
+        except (ValueError, KeyError, TypeError, ImportError, AttributeError) as e:
+            return web.json_response(dict(error=f'{e.__class__.__name__}: {e}'), status=400)
+        log.info('admin: added command %s -> %s', data['command'], data['callback'])
+        return web.json_response(self._bot.describe_commands(), status=201)
+
+    async def _remove_command(self, request: web.Request) -> web.Response:
+        command = request.query.get('command')
+        if command is not None and command == self._bot.default_action:
+            return web.json_response(dict(error=f'{command} is the default action'), status=409)
+        try:
+            self._bot.remove_command(command)
+        except KeyError:
+            return web.json_response(dict(error=f'unknown command: {command}'), status=404)
+        log.info('admin: removed command %s', command)
+        return web.json_response(self._bot.describe_commands())
+
+    async def _in_flight(self, request: web.Request) -> web.Response:
+        return web.json_response(self._bot.in_flight())
+
+    async def _slowest(self, request: web.Request) -> web.Response:
+        try:
+            n = int(request.query.get('n', 10))
+        except ValueError:
+            return web.json_response(dict(error='n has to be an integer'), status=400)
+        return web.json_response(self._bot.slowest_commands(n))
+
+    async def _resize_pool(self, request: web.Request) -> web.Response:
+        try:
+            data = await request.json()
+            self._bot.resize_pool(int(data['max_workers']))
+        except (ValueError, KeyError, TypeError) as e:
+            return web.json_response(dict(error=f'{e.__class__.__name__}: {e}'), status=400)
+        log.info('admin: resized pool to %s workers', data['max_workers'])
+        return web.json_response(self._bot.status()['pool'])
@@ -0,0 +1,240 @@
+"""
+Async versions of the demobot commands for BotSocket. All I/O uses a single shared aiohttp session so that a command
+waiting for a third party site doesn't tie up a thread. The sync versions in demobot are still used by the Flask based
+TeamsBot.
+
+Register the same way as the sync versions:
+    api = AsyncWebexAPI(access_token, send=bot.send)
+    bot.add_command('/chuck', 'get Chuck Norris joke', get_joke)
+    bot.add_command('/traffic', 'show traffic cams', functools.partial(traffic, api))
+"""
+import asyncio
+import random
+import logging
+
+import aiohttp
+
+from typing import Optional, Dict, Any, Callable, Awaitable
+
+import circuitbreaker
+import demobot
+from demobot import serve_stale, upload_cache
+
+log = logging.getLogger(__name__)
+
+# timeout for requests to third party sites; commands registered with a deadline are cancelled earlier
+TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+# errors indicating that a third party site is not available
+UPSTREAM_ERRORS = (circuitbreaker.CircuitOpen, aiohttp.ClientError, asyncio.TimeoutError)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Shared HTTP session; created on first use in the running event loop
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=TIMEOUT)
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+class AsyncWebexAPI:
+    """
+    The few Webex API calls the commands need
+    """
+
+    def __init__(self, access_token: str, messages_url: str = demobot.MESSAGES_URL,
+                 send: Optional[Callable[..., Awaitable[Dict[str, Any]]]] = None) -> None:
+        """
+        :param access_token: access token
+        :param messages_url: URL to post messages to
+        :param send: queue messages for delivery instead of posting them directly, e.g. BotSocket.send. Messages
+            posted by commands then keep their order with the replies of the bot
+        """
+        self._headers = {'Authorization': f'Bearer {access_token}'}
+        self._messages_url = messages_url
+        self._send = send
+
+    async def create_message(self, **message) -> Dict[str, Any]:
+        """
+        Post a message
+        :param message: message parameters: roomId, text, markdown, files, ...
+        :return: posted message
+        """
+        if self._send:
+            return await self._send(**message)
+        async with get_session().post(self._messages_url, json=message, headers=self._headers) as r:
+            r.raise_for_status()
+            return await r.json()
+
+    async def create_message_with_file(self, roomId: str, text: str, filename: str, content: bytes,
+                                       content_type: str) -> Dict[str, Any]:
+        """
+        Post a message with a local file as attachment
+        :return: posted message
+        """
+        if self._send:
+            return await self._send(roomId=roomId, text=text, files=(filename, content, content_type))
+        data = aiohttp.FormData()
+        data.add_field('roomId', roomId)
+        data.add_field('text', text)
+        data.add_field('files', content, filename=filename, content_type=content_type)
+        async with get_session().post(self._messages_url, data=data, headers=self._headers) as r:
+            r.raise_for_status()
+            return await r.json()
+
+
+async def http_get(url: str, **kwargs) -> aiohttp.ClientResponse:
+    """
+    GET a resource from a third party site guarded by the circuit breaker for the site. The body of the response is
+    read already
+    :param url: URL
+    :return: response
+    """
+    with circuitbreaker.breaker(url):
+        async with get_session().get(url, **kwargs) as r:
+            # server errors count as failures of the site
+            if r.status >= 500:
+                r.raise_for_status()
+            await r.read()
+    return r
+
+
+async def post_file(api: AsyncWebexAPI, room_id: str, file: str, reuse: bool = False) -> None:
+    """
+    Post a file given by URL to a space; see demobot.post_file()
+    """
+    digest = upload_cache.digest(file) if reuse else None
+    message_id = digest and await upload_cache.lookup_async(room_id, digest)
+    if message_id is not None:
+        await api.create_message(roomId=room_id, parentId=message_id, text='Same image as posted here before.')
+        return
+    async with upload_cache.upload_slot_async(room_id):
+        message = await api.create_message(roomId=room_id, files=[file])
+    if reuse:
+        upload_cache.remember(room_id, digest, message['id'])
+
+
+@serve_stale('Chuck Norris is taking a break. Try again later.', errors=UPSTREAM_ERRORS)
+async def get_joke(message):
+    r = await http_get(demobot.ICNDB_URL, params={'limitTo': '[nerdy]'})
+    r = await r.json()
+    return r['value']['joke']
+
+
+async def get_snarl_traffic_cam_image_url(camera_id) -> Optional[str]:
+    """
+    Get the URL of a traffic cam image from http://victoria.snarl.com.au
+    """
+    try:
+        r = await http_get(demobot.SNARL_CAM_URL.format(camera_id))
+    except circuitbreaker.CircuitOpen:
+        return None
+    return demobot.snarl_image_url(await r.text())
+
+
+async def traffic(api: AsyncWebexAPI, message):
+    """
+    Act on the /traffic command. Post a few traffic cam images to a space
+    """
+    room_id = message.roomId
+
+    # the snarl pages can be read while the German cams are posted
+    pages = [asyncio.ensure_future(get_snarl_traffic_cam_image_url(cam_id)) for cam_id in demobot.SNARL_CAM_IDS]
+    try:
+        # post one after the other to keep the order of the images
+        for file in demobot.GERMAN_TRAFFIC_CAMS:
+            await post_file(api, room_id, file)
+        snarl_cam_urls = await asyncio.gather(*pages, return_exceptions=True)
+    finally:
+        # posting failed or the command was cancelled (deadline): don't leave the page requests running
+        for page in pages:
+            page.cancel()
+
+    for cam_url in snarl_cam_urls:
+        if isinstance(cam_url, str):
+            await post_file(api, room_id, cam_url)
+
+    return 'Traffic cam images posted above as requested'
+
+
+@serve_stale('No fun fact available right now.', key=lambda message: demobot.number_param(message.text),
+             errors=UPSTREAM_ERRORS)
+async def number(api: AsyncWebexAPI, message):
+    """
+    Get a fun fact for a number
+    """
+    number = demobot.number_param(message.text)
+    if number is None:
+        number = 'random'
+        await api.create_message(roomId=message.roomId,
+                                 text='No number provided. Getting fun fact for a randum number.')
+    r = await http_get(demobot.NUMBERS_URL.format(number=number))
+    return await r.text()
+
+
+async def dilbert(api: AsyncWebexAPI, message):
+    search_param = demobot.dilbert_param(message.text)
+    search_url = demobot.DILBERT_SEARCH_URL.format(search_param=search_param)
+    try:
+        r = await http_get(search_url)
+    except circuitbreaker.CircuitOpen:
+        return 'Sorry, dilbert.com is not available right now'
+    images = demobot.dilbert_images(await r.text(), search_url)
+    if not images:
+        return f'Sorry, couldn\'t find any Dilbert strip for your search term \'{search_param}\''
+    await post_file(api, message.roomId, random.choice(images), reuse=True)
+    return 'Here you go..'
+
+
+async def peanuts(api: AsyncWebexAPI, message):
+    """
+    Get a random Peanuts comic from the Peanuts web page and post that comic to the space
+    """
+    try:
+        r = await http_get(demobot.PEANUTS_URL)
+    except circuitbreaker.CircuitOpen:
+        return 'Sorry, peanuts.com is not available right now'
+    images = demobot.peanuts_images(await r.text())
+    if not images:
+        return 'Sorry, couldn\'t find any Peanuts comics'
+
+    # the image URL only works with the cookies set by the comics page and a referer; see demobot.peanuts()
+    try:
+        r = await http_get(random.choice(images), headers=dict(referer=demobot.PEANUTS_URL))
+    except circuitbreaker.CircuitOpen:
+        return 'Sorry, peanuts.com is not available right now'
+    content = await r.read()
+
+    # no need to upload the same comic again if we just posted it to the same space
+    digest = upload_cache.digest(content)
+    message_id = await upload_cache.lookup_async(message.roomId, digest)
+    if message_id is not None:
+        await api.create_message(roomId=message.roomId, parentId=message_id, text='Same comic as posted here before.')
+        return 'How do you like that?'
+
+    async with upload_cache.upload_slot_async(message.roomId):
+        posted = await api.create_message_with_file(roomId=message.roomId, text='Here you go', filename='Image.png',
+                                                    content=content, content_type=r.headers['content-type'])
+    upload_cache.remember(message.roomId, digest, posted['id'])
+    return 'How do you like that?'
+
+
+@serve_stale('No quote available right now.', errors=UPSTREAM_ERRORS)
+async def quote(message):
+    r = await http_get(demobot.QUOTES_URL)
+    return demobot.format_quote(await r.json(content_type=None))
+
+
+async def card_demo(api: AsyncWebexAPI, message):
+    await api.create_message(**demobot.card_message(message.roomId))
+    return ''
@@ -0,0 +1,115 @@
+"""
+Concurrent command throughput of the sync demobot handlers (executed in a pool of 4 threads like in BotSocket) vs. the
+async handlers of asyncdemobot (executed in the event loop). The third party sites are replaced by a local stand-in
+which answers after a fixed delay.
+
+    python benchmarks/bench_handlers.py [--calls 200] [--delay 0.1]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import demobot  # noqa: E402
+import asyncdemobot  # noqa: E402
+
+
+class Message:
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.roomId = 'room'
+
+
+class StandIn:
+    """
+    stand-in for icndb, numbersapi and quotesondesign running in a separate thread
+    """
+
+    def __init__(self, delay: float) -> None:
+        self._delay = delay
+        self._started = threading.Event()
+        self.base_url = ''
+
+    async def _joke(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self._delay)
+        return web.json_response({'type': 'success', 'value': {'id': 1, 'joke': 'Chuck Norris can divide by zero.'}})
+
+    async def _number(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self._delay)
+        return web.Response(text=f'{request.match_info["number"]} is a number.')
+
+    async def _quotes(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self._delay)
+        return web.json_response([{'content': {'rendered': 'Less is more.'}, 'title': {'rendered': 'Mies'}}])
+
+    async def _serve(self) -> None:
+        app = web.Application()
+        app.router.add_get('/jokes/random', self._joke)
+        app.router.add_get('/numbers/{number}', self._number)
+        app.router.add_get('/quotes', self._quotes)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, host='127.0.0.1', port=0)
+        await site.start()
+        self.base_url = f'http://127.0.0.1:{runner.addresses[0][1]}'
+        self._started.set()
+        await asyncio.Event().wait()
+
+    def start(self) -> str:
+        threading.Thread(target=asyncio.run, args=(self._serve(),), daemon=True).start()
+        self._started.wait()
+        return self.base_url
+
+
+def calls(n: int):
+    """
+    mix of commands: (sync handler, async handler, message)
+    """
+    commands = [
+        (demobot.get_joke, asyncdemobot.get_joke, Message('/chuck')),
+        (lambda m: demobot.number(None, m), lambda m: asyncdemobot.number(None, m), Message('/number 42')),
+        (demobot.quote, asyncdemobot.quote, Message('/quote')),
+    ]
+    return [commands[i % len(commands)] for i in range(n)]
+
+
+def bench_sync(n: int) -> float:
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda c: c[0](c[2]), calls(n)))
+        return time.perf_counter() - start
+
+
+async def bench_async(n: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(c[1](c[2]) for c in calls(n)))
+    elapsed = time.perf_counter() - start
+    await asyncdemobot.close_session()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.1, help='response time of the stand-in in seconds')
+    args = parser.parse_args()
+
+    base_url = StandIn(args.delay).start()
+    demobot.ICNDB_URL = f'{base_url}/jokes/random'
+    demobot.NUMBERS_URL = f'{base_url}/numbers/{{number}}'
+    demobot.QUOTES_URL = f'{base_url}/quotes'
+
+    for name, elapsed in (('sync, 4 threads', bench_sync(args.calls)),
+                          ('async, event loop', asyncio.run(bench_async(args.calls)))):
+        print(f'{name:<20} {args.calls} calls in {elapsed:6.2f} s: {args.calls / elapsed:8.1f} commands/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Logging cost per websocket message: eager f-string logging to a stream handler (as before) vs. lazy formatting through
+the queue based setup of botlogging, with and without sampling.
+
+    python benchmarks/bench_logging.py
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import botlogging  # noqa: E402
+from botlogging import SAMPLED  # noqa: E402
+
+MESSAGES = 20000
+
+log = logging.getLogger('bench')
+
+
+class Frame:
+    """
+    stand-in for a websocket message; the repr of an actual frame contains the complete activity JSON
+    """
+
+    def __init__(self) -> None:
+        self.data = b'{"data": {"eventType": "conversation.activity", "activity": {}}}' * 30
+
+    def __repr__(self) -> str:
+        return f'WSMessage(type=<WSMsgType.BINARY: 2>, data={self.data!r}, extra=\'\')'
+
+
+def eager(frame: Frame) -> None:
+    log.debug(f'got message from websocket: {frame}')
+    log.debug(f'process: message {id(frame)} from: someone@example.com')
+    log.debug(f'process: message {id(frame)} from: someone@example.com done')
+
+
+def lazy(frame: Frame) -> None:
+    log.debug('got message from websocket: %s', frame, extra=SAMPLED)
+    log.debug('process: message %s from: %s', id(frame), 'someone@example.com')
+    log.debug('process: message %s from: %s done', id(frame), 'someone@example.com')
+
+
+def reset_logging() -> None:
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+
+
+def measure(name: str, func, setup) -> None:
+    reset_logging()
+    listener = setup()
+    frame = Frame()
+    start = time.perf_counter()
+    for _ in range(MESSAGES):
+        func(frame)
+    elapsed = time.perf_counter() - start
+    if listener is not None:
+        # include the time it takes to drain the queue
+        botlogging.stop_logging()
+        drained = time.perf_counter() - start
+    else:
+        drained = elapsed
+    print(f'{name:<45} {elapsed / MESSAGES * 1e6:8.2f} us/message in caller, '
+          f'{drained / MESSAGES * 1e6:8.2f} us/message total')
+
+
+def main():
+    devnull = open(os.devnull, 'w')
+
+    def stream(level):
+        def setup():
+            logging.basicConfig(level=level, stream=devnull,
+                                format='%(asctime)s %(threadName)s %(name)-12s %(levelname)-8s %(message)s')
+        return setup
+
+    def queued(level, structured=False, sample_rate=1):
+        def setup():
+            return botlogging.setup_logging(level=level, structured=structured, sample_rate=sample_rate,
+                                            handler=logging.StreamHandler(devnull))
+        return setup
+
+    measure('before: f-strings, DEBUG', eager, stream(logging.DEBUG))
+    measure('before: f-strings, INFO', eager, stream(logging.INFO))
+    measure('after: lazy, INFO', lazy, queued(logging.INFO))
+    measure('after: lazy, DEBUG, queued', lazy, queued(logging.DEBUG))
+    measure('after: lazy, DEBUG, queued, sampled 1/100', lazy, queued(logging.DEBUG, sample_rate=100))
+    measure('after: lazy, DEBUG, queued, JSON', lazy, queued(logging.DEBUG, structured=True))
+
+
+if __name__ == '__main__':
+    main()
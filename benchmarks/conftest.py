@@ -0,0 +1,58 @@
+"""
+Fixtures for the micro-benchmarks: saved pages of the third party sites, websocket frames and a BotSocket with the
+commands of the demo bot
+"""
+import glob
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+# email address of the bot in the saved frames
+BOT_EMAIL = 'demobot@webex.bot'
+
+# commands of the demo bot
+COMMANDS = ('/chuck', '/traffic', '/quote', '/number', '/dilbert', '/peanuts')
+
+
+def pytest_configure(config):
+    # runs before pytest-benchmark sets up its session
+    if config.getoption('benchmark_storage') == 'file://./.benchmarks':
+        config.option.benchmark_storage = f'file://{BASELINES}'
+    if config.getoption('benchmark_compare') is not None and not glob.glob(os.path.join(BASELINES, '*', '*.json')):
+        # nothing to compare against before the first baseline has been saved
+        config.option.benchmark_compare = None
+        config.option.benchmark_compare_fail = None
+
+
+def load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf8') as f:
+        return f.read()
+
+
+@pytest.fixture(scope='session')
+def frames():
+    """
+    websocket frames by type: post, self (posted by the bot itself), acknowledge, other_event
+    """
+    return {name: json.dumps(frame).encode('utf8') for name, frame in json.loads(load_fixture('frames.json')).items()}
+
+
+@pytest.fixture(scope='session')
+def bot():
+    # imported here so that collecting the benchmarks doesn't fail if pytest-benchmark isn't installed
+    pytest.importorskip('pytest_benchmark')
+    from botsocket import BotSocket
+    bot = BotSocket(access_token='benchmark')
+    # normally set by start_session() from people/me
+    bot._ignore_emails = [BOT_EMAIL]
+    for command in COMMANDS:
+        bot.add_command(command, f'{command[1:]} demo command', lambda message: None)
+    yield bot
+    bot._executor.shutdown()
@@ -0,0 +1,72 @@
+"""
+Micro-benchmarks of the functions on the message hot path, each timed by itself. See pytest.ini for baselines and
+the regression threshold.
+"""
+from commands import Command, CommandRegistry
+from conftest import load_fixture, COMMANDS
+import demobot
+
+
+def test_frame_post(benchmark, bot, frames):
+    assert benchmark(bot.message_id_from_frame, frames['post']) is not None
+
+
+def test_frame_self(benchmark, bot, frames):
+    assert benchmark(bot.message_id_from_frame, frames['self']) is None
+
+
+def test_frame_acknowledge(benchmark, bot, frames):
+    assert benchmark(bot.message_id_from_frame, frames['acknowledge']) is None
+
+
+def test_frame_other_event(benchmark, bot, frames):
+    assert benchmark(bot.message_id_from_frame, frames['other_event']) is None
+
+
+def test_resolve_command(benchmark, bot):
+    # last registered command: worst case for a match
+    assert benchmark(bot.resolve_command, 'Demobot /peanuts') == ('/peanuts', '')
+
+
+def test_resolve_command_default(benchmark, bot):
+    # no command: all commands are checked before falling back to the default action
+    assert benchmark(bot.resolve_command, 'Demobot hello, what can you do for me?') == (
+        '/help', 'Demobot hello, what can you do for me?')
+
+
+def test_extract_message(benchmark, bot):
+    assert benchmark(bot.extract_message, '/number', 'Demobot /number 42') == ' 42'
+
+
+def test_send_help(benchmark, bot):
+    assert benchmark(bot.send_help, None).startswith('Hello!')
+
+
+def test_send_help_render(benchmark):
+    registry = CommandRegistry()
+    for command in ('/echo', '/help') + COMMANDS:
+        registry.add(Command(command=command, help=f'{command[1:]} demo command', callback=lambda message: None))
+    hidden = Command(command='/benchmark', help='*', callback=lambda message: None)
+
+    def render():
+        # adding a command invalidates the cached help; the cost of adding is part of the measurement
+        registry.add(hidden)
+        return registry.help_markdown()
+
+    assert benchmark(render).startswith('Hello!')
+
+
+def test_peanuts_images(benchmark):
+    html = load_fixture('peanuts.html')
+    assert len(benchmark(demobot.peanuts_images, html)) == 12
+
+
+def test_snarl_image_url(benchmark):
+    html = load_fixture('snarl.html')
+    assert benchmark(demobot.snarl_image_url, html).endswith('105.jpg?t=1565000000')
+
+
+def test_dilbert_images(benchmark):
+    html = load_fixture('dilbert.html')
+    search_url = demobot.DILBERT_SEARCH_URL.format(search_param='management')
+    assert len(benchmark(demobot.dilbert_images, html, search_url)) == 10
@@ -0,0 +1,114 @@
+"""
+Logging setup for the bot with low overhead on the hot path:
+* log records are handed to a queue; formatting and I/O happen in a separate listener thread so that logging never
+  blocks the event loop or the executor threads
+* optional JSON output (one object per line)
+* sampling of high volume records: records logged with `extra=SAMPLED` are only emitted once every `sample_rate` times
+  per message template
+
+Log calls on the hot path should use lazy %-formatting (log.debug('x: %s', x)) so that no string (and no repr of
+large objects) is built for records which are not emitted.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import atexit
+import itertools
+from collections import defaultdict
+
+from typing import Dict, Any, Optional
+
+# pass as `extra` for high volume records which can be sampled
+SAMPLED = {'sampled': True}
+
+# attributes every log record has; anything else has been passed as extra
+_RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', None, None).__dict__) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format log records as JSON objects
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = dict(time=record.created, level=record.levelname, logger=record.name,
+                                    thread=record.threadName, message=record.getMessage())
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler which leaves formatting of the record to the listener thread. The standard QueueHandler formats the
+    message in the logging thread so that records can be pickled; that's not needed for an in-process queue
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Only let every n-th record with a given message template pass if the record has been logged with extra=SAMPLED.
+    Sampled records need to use %-formatting; the message template is the key for sampling
+    """
+
+    def __init__(self, rate: int) -> None:
+        super().__init__()
+        self._rate = rate
+        self._counters = defaultdict(itertools.count)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self._rate <= 1 or not getattr(record, 'sampled', False):
+            return True
+        # itertools.count is thread safe
+        return next(self._counters[(record.name, record.msg)]) % self._rate == 0
+
+
+def setup_logging(level: int = logging.INFO, structured: bool = False, sample_rate: int = 1,
+                  fmt: str = '%(asctime)s %(threadName)s %(name)-12s %(levelname)-8s %(message)s',
+                  handler: Optional[logging.Handler] = None) -> logging.handlers.QueueListener:
+    """
+    Configure the root logger to log through a queue
+    :param level: log level
+    :param structured: log JSON objects instead of text lines
+    :param sample_rate: only emit every n-th record of high volume records (logged with extra=SAMPLED)
+    :param fmt: format for text lines
+    :param handler: handler doing the actual output; default: stderr
+    :return: the listener thread; stopped automatically at exit or by stop_logging()
+    """
+    handler = handler or logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if structured else logging.Formatter(fmt))
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    # sampling before records are queued saves the queueing cost for dropped records
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    global _listener
+    stop_logging()
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+@atexit.register
+def stop_logging() -> None:
+    """
+    Stop the listener thread started by setup_logging() after all queued records have been written
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -6,13 +6,46 @@ import webexteamssdk
 import logging
 import functools
 import base64
-from demobot import get_joke, traffic, number, dilbert, peanuts, quote
-from concurrent.futures import ThreadPoolExecutor, Executor
-
-from typing import Optional, Callable, List, Coroutine, Dict, Any, NoReturn
+import socket
+import uuid
+import time
+import deadline
+import journal
+import circuitbreaker
+from collections import Counter, deque
+from admin import AdminServer
+from asyncdemobot import AsyncWebexAPI, get_joke, traffic, number, dilbert, peanuts, quote
+from demobot import upload_cache, share_state
+from coalesce import Coalescer, AsyncCoalescer
+from commands import Command, CommandRegistry, ASYNC
+from delivery import RoomDelivery
+from durablequeue import DurableQueue
+from botlogging import SAMPLED, setup_logging
+from statebackend import StateBackend, RedisBackend, SharedCache
+from throttle import Throttle
+from concurrent.futures import ThreadPoolExecutor, Executor, Future
+
+from typing import Optional, Callable, List, Coroutine, Dict, Any, NoReturn, Tuple, Union, Deque
 
 ALWAYS_USE_NEW_DEVICE = False  # if set all existing Bot devices will be deleted
 WDM_DEVICES = 'https://wdm-a.wbx2.com/wdm/api/v1/devices'
+API_BASE = 'https://api.ciscospark.com/v1'
+
+# shared state with multiple instances
+LEADER = 'websocket'  # leadership for the device registration and websocket
+LEADER_TTL = 15  # leader has to renew leadership within this time
+WORK_QUEUE = 'messages'  # shared queue of message ids to process
+SEEN_TTL = 3600  # time for which message ids are remembered to detect duplicates
+
+# number of recently executed commands kept for the admin server
+RECENT_COMMANDS = 256
+
+# connection states
+STOPPED = 'stopped'
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+DISCONNECTED = 'disconnected'
+STANDBY = 'standby'  # not the leader; only processing messages from the shared work queue
 
 log = logging.getLogger(__name__)
 
@@ -28,188 +61,392 @@ class BotSocket:
                  access_token: str,
                  device_name: Optional[str] = None,
                  default_action: Optional[str] = '/help',
-                 executor: Optional[Executor] = None) -> None:
+                 executor: Optional[Executor] = None,
+                 api_base: str = API_BASE,
+                 journal: Optional['journal.Journal'] = None,
+                 queue: Optional[DurableQueue] = None,
+                 backend: Optional[StateBackend] = None,
+                 max_in_flight: int = 8,
+                 throttle: Optional[Throttle] = None,
+                 throttle_reply: Optional[str] = 'Slow down! Please try again in {retry:.0f} seconds.',
+                 admin: Optional[AdminServer] = None,
+                 pool_size: int = 4) -> None:
         self._token = access_token
         self._device_name = device_name or os.path.basename(os.path.splitext(__file__)[0])
         self._session: Optional[aiohttp.ClientSession] = None
-        self._api = webexteamssdk.WebexTeamsAPI(access_token=access_token)
-        self._commands = {
-            "/echo": {
-                "help": "Display help text.",
-                "callback": self.send_echo,
-            },
-            "/help": {"help": "Get help.", "callback": self.send_help},
-        }
+        self._api_base = api_base
+        self._api = webexteamssdk.WebexTeamsAPI(access_token=access_token, base_url=f'{api_base}/')
+        self._journal = journal
+        self._queue = queue
+        self._backend = backend
+        self._instance_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._max_in_flight = max_in_flight
+        self._throttle = throttle
+        self._throttle_reply = throttle_reply
+        self._ignore_emails: List[str] = []
+        self._commands = CommandRegistry()
+        self.add_command("/echo", "Display help text.", self.send_echo)
+        self.add_command("/help", "Get help.", self.send_help)
         self._default_action = default_action
-        self._executor = executor or ThreadPoolExecutor(max_workers=4)
-
-
-@property
-def auth(self) -> str:
-    return f'Bearer {self._token}'
-
-
-async def request(self, method: str,
-                  url: str,
-                  headers: Optional[Dict[str, str]] = None, **kwargs) -> Dict[str, Any]:
-    headers = headers or dict()
-    headers['Authorization'] = self.auth
-    async with self._session.request(method=method, url=url, headers=headers, **kwargs) as r:
-        r.raise_for_status()
-        result = await r.json()
-    return result
-
-
-async def get(self, url: str, **kwargs) -> Dict[str, Any]:
-    return await self.request(method='GET', url=url, **kwargs)
-
-
-async def post(self, url: str, **kwargs) -> Dict[str, Any]:
-    return await self.request(method='POST', url=url, **kwargs)
-
-
-async def put(self, url: str, **kwargs) -> Dict[str, Any]:
-    return await self.request(method='PUT', url=url, **kwargs)
-
-
-async def delete(self, url: str, **kwargs) -> Dict[str, Any]:
-    return await self.request(method='DELETE', url=url, **kwargs)
-
-
-async def find_device(self) -> Optional[Dict[str, Any]]:
-    """
-    Get the WDM device list and return the device created by the bot (if any)
-    :return: existing device or None
-    """
-    device = None
-    try:
-        r = await self.get(url=WDM_DEVICES)
-        devices = r['devices']
-        # there should only be one device!?
-        if len(devices) > 1:
-            log.warning(f'Found {len(devices)} devices: {", ".join(d["name"] for d in devices)}')
-        if ALWAYS_USE_NEW_DEVICE or len(devices) > 1:
-            log.debug(f'deleting {len(devices)} device(s)...')
-            tasks = [self.delete(url=d['url']) for d in devices]
-            r = await asyncio.gather(*tasks, return_exceptions=True)
-            devices = []
-        # get a device from the (potentially empty) list of devices
-        device = next((d for d in devices if d['name'] == self._device_name), None)
-        if device is not None:
-            # update registration
-            log.debug(f'Updating registration {device["url"]}')
-            device = await self.put(url=device['url'], json=device)
-    except aiohttp.ClientResponseError as e:
-        e: aiohttp.ClientResponseError
-        if e.status == 404:
-            # api throws a 404 if no devices exist
-            return None
-        raise e
-    return device
-
-
-async def create_device(self) -> Dict[str, Any]:
-    """
-    create/register a new WDM device for the bot
-    :return: device
-    """
-    device = dict(
-        deviceName=f'{self._device_name}-client',
-        deviceType='DESKTOP',
-        localizedModel='python',
-        model='python',
-        name=f'{self._device_name}',
-        systemName=f'{self._device_name}',
-        systemVersion='0.1'
-    )
-    device = await self.post(url=WDM_DEVICES, json=device)
-    log.debug(f'New device {device["url"]}')
-    return device
-
-
-async def get_message(self, message_id: str) -> Optional[webexteamssdk.Message]:
-    """
-    Get a message given a message id
-    :param message_id: message id; can be a UUID or a Webex id (api is fine w/ both!)
-    :return: obtained message or None
-    """
-    try:
-        r = await self.get(url=f'https://api.ciscospark.com/v1/messages/{message_id}')
+        # the size of the pool can only be changed if we own the executor
+        self._pool_size = None if executor else pool_size
+        self._executor = executor or ThreadPoolExecutor(max_workers=pool_size)
+        self._coalescer = Coalescer()
+        self._async_coalescer = AsyncCoalescer()
+        self._delivery: Optional[RoomDelivery] = None
+        # number of deadline-exceeded events per command
+        self.deadline_exceeded: Counter = Counter()
+        self._admin = admin
+        self.connection_state = STOPPED
+        self.device_url: Optional[str] = None
+        self.connected_since: Optional[float] = None
+        self.last_frame: Optional[float] = None
+        # commands being executed: message id -> (command, execution class, start time)
+        self._in_flight: Dict[str, Tuple[str, str, float]] = {}
+        # recently executed commands: (command, message id, duration, end time)
+        self._recent: Deque[Tuple[str, str, float, float]] = deque(maxlen=RECENT_COMMANDS)
+
+    @property
+    def auth(self) -> str:
+        return f'Bearer {self._token}'
+
+    async def request(self, method: str,
+                      url: str,
+                      headers: Optional[Dict[str, str]] = None, **kwargs) -> Dict[str, Any]:
+        headers = headers or dict()
+        headers['Authorization'] = self.auth
+        async with self._session.request(method=method, url=url, headers=headers, **kwargs) as r:
+            if self._journal:
+                self._journal.write(journal.REST, json.dumps(dict(method=method, url=url, status=r.status,
+                                                                  request=kwargs.get('json'),
+                                                                  response=await r.text())).encode('utf8'))
+            r.raise_for_status()
+            result = await r.json()
+        return result
+
+    async def get(self, url: str, **kwargs) -> Dict[str, Any]:
+        return await self.request(method='GET', url=url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> Dict[str, Any]:
+        return await self.request(method='POST', url=url, **kwargs)
+
+    async def put(self, url: str, **kwargs) -> Dict[str, Any]:
+        return await self.request(method='PUT', url=url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> Dict[str, Any]:
+        return await self.request(method='DELETE', url=url, **kwargs)
+
+    async def find_device(self) -> Optional[Dict[str, Any]]:
+        """
+        Get the WDM device list and return the device created by the bot (if any)
+        :return: existing device or None
+        """
+        device = None
+        try:
+            r = await self.get(url=WDM_DEVICES)
+            devices = r['devices']
+            # there should only be one device!?
+            if len(devices) > 1:
+                log.warning(f'Found {len(devices)} devices: {", ".join(d["name"] for d in devices)}')
+            if ALWAYS_USE_NEW_DEVICE or len(devices) > 1:
+                log.debug(f'deleting {len(devices)} device(s)...')
+                tasks = [self.delete(url=d['url']) for d in devices]
+                r = await asyncio.gather(*tasks, return_exceptions=True)
+                devices = []
+            # get a device from the (potentially empty) list of devices
+            device = next((d for d in devices if d['name'] == self._device_name), None)
+            if device is not None:
+                # update registration
+                log.debug(f'Updating registration {device["url"]}')
+                device = await self.put(url=device['url'], json=device)
+        except aiohttp.ClientResponseError as e:
+            e: aiohttp.ClientResponseError
+            if e.status == 404:
+                # api throws a 404 if no devices exist
+                return None
+            raise e
+        return device
+
+    async def create_device(self) -> Dict[str, Any]:
+        """
+        create/register a new WDM device for the bot
+        :return: device
+        """
+        device = dict(
+            deviceName=f'{self._device_name}-client',
+            deviceType='DESKTOP',
+            localizedModel='python',
+            model='python',
+            name=f'{self._device_name}',
+            systemName=f'{self._device_name}',
+            systemVersion='0.1'
+        )
+        device = await self.post(url=WDM_DEVICES, json=device)
+        log.debug(f'New device {device["url"]}')
+        return device
+
+    async def get_message(self, message_id: str) -> Optional[webexteamssdk.Message]:
+        """
+        Get a message given a message id
+        :param message_id: message id; can be a UUID or a Webex id (api is fine w/ both!)
+        :return: obtained message or None if the message doesn't exist (anymore); other errors are raised
+        """
+        try:
+            r = await self.get(url=f'{self._api_base}/messages/{message_id}')
+        except aiohttp.ClientResponseError as e:
+            if e.status == 404:
+                return None
+            raise
         return webexteamssdk.Message(r)
-    except Exception as e:
-        return None
-
-
-def run(self) -> NoReturn:
-    """
-    Actually run the bot; never returns
-    :return: never returns
-    """
 
-    def process(message: webexteamssdk.Message) -> None:
+    def process(self, message: webexteamssdk.Message) -> Optional[Future]:
         """
         Get details of message references in a given activity and call the defined callback w/ the detailed message
         data
         this is run in a thread to avoid blocking asynchronous handling
         :param message: websocket message to process
-        :param ignore_emails: list of emails to ignore
+        :return: future for the delivery of the reply; None if there is no reply
         """
 
         # Log details of message
-        log.debug(f'process: message {message.id} from: {message.personEmail}')
-
-        # Find the command that was sent, if any
-        command = ""
-        for c in self._commands.items():
-            if message.text.find(c[0]) != -1:
-                command = c[0]
-                log.debug(f'Found command: {command}')
-                # If a command was found, stop looking for others
-                break
+        log.debug('process: message %s from: %s', message.id, message.personEmail)
 
         # Build the reply to the user
         reply = None
 
         # Take action based on command
-        # If no command found, send the default_action
-        if command in [""] and self._default_action:
-            reply = self._commands[self._default_action]["callback"](message)
-        elif command in self._commands.keys():
-            reply = self._commands[command]["callback"](message)
-        else:
-            pass
+        command, arguments = self.resolve_command(message.text)
+        if command is not None:
+            reply = self.call_command(command, message, arguments)
 
         # allow command handlers to craft their own Teams message
+        # the reply is queued for delivery; no need to wait for the message to be posted
+        delivery = None
         if reply:
-            self._api.messages.create(roomId=message.roomId, markdown=reply)
-        log.debug(f'process: message {message.id} from: {message.personEmail} done')
-        return
+            delivery = self._delivery.send_threadsafe(roomId=message.roomId, markdown=reply)
+        log.debug('process: message %s from: %s done', message.id, message.personEmail)
+        return delivery
 
-    async def get_message_and_process(message_id: str) -> None:
+    async def process_async(self, message: webexteamssdk.Message) -> Optional[asyncio.Future]:
+        """
+        Same as process() for commands with a coroutine function as callback; runs in the event loop
+        :param message: websocket message to process
+        :return: future for the delivery of the reply; None if there is no reply
+        """
+        log.debug('process_async: message %s from: %s', message.id, message.personEmail)
+        reply = None
+        command, arguments = self.resolve_command(message.text)
+        if command is not None:
+            reply = await self.call_command_async(command, message, arguments)
+        delivery = None
+        if reply:
+            delivery = self._delivery.send(roomId=message.roomId, markdown=reply)
+        log.debug('process_async: message %s from: %s done', message.id, message.personEmail)
+        return delivery
+
+    def send(self, roomId: str, **message) -> asyncio.Future:
+        """
+        Queue a message for delivery to a room in order with the replies of the bot; for commands posting messages
+        themselves. Has to be called from the event loop
+        :param roomId: room id
+        :param message: message parameters, see RoomDelivery.send()
+        :return: future with the posted message
+        """
+        return self._delivery.send(roomId, **message)
+
+    def send_threadsafe(self, roomId: str, **message) -> Future:
+        """
+        Same as send() for commands executed in a thread; does not wait for the message to be posted
+        """
+        return self._delivery.send_threadsafe(roomId, **message)
+
+    def find_command(self, text: str) -> str:
+        """
+        Find the command that was sent, if any
+        :param text: message text
+        :return: command or empty string
+        """
+        c = self._commands.find(text)
+        if c is None:
+            return ""
+        log.debug('Found command: %s', c.command)
+        return c.command
+
+    def resolve_command(self, text: str) -> Tuple[Optional[str], str]:
+        """
+        Determine the command to execute for a message text. If no command is found the default action is executed
+        :param text: message text
+        :return: tuple of command (None if there is nothing to execute) and command arguments
+        """
+        command = self.find_command(text)
+        if command == "":
+            # the command of the default action might have been removed
+            return (self._default_action if self._default_action in self._commands else None), text
+        return command, self.extract_message(command, text)
+
+    def processed(self, message_id: str, future: Future) -> None:
+        """
+        Callback for the future of process(): mark the message as done in the durable queue once the reply is posted
+        :param message_id: message id as received on the websocket
+        :param future: future of process()
+        """
+        if future.exception() is not None:
+            # no point in trying again after a restart
+            log.error('processing of message %s failed: %r', message_id, future.exception())
+            self._queue.done(message_id)
+            return
+        delivery: Optional[Future] = future.result()
+        if delivery is None:
+            self._queue.done(message_id)
+            return
+
+        def delivered(f: Future) -> None:
+            if f.exception() is not None:
+                # leave the message pending; it will be processed again after a restart
+                return
+            self._queue.done(message_id)
+
+        delivery.add_done_callback(delivered)
+
+    async def ingest(self, message_id: str) -> Optional[Future]:
+        """
+        Record a message received on the websocket in the durable queue and process it. Duplicates are ignored
+        :param message_id: message id
+        :return: future of the processing in the thread; None if the message is not processed
+        """
+        new = await asyncio.wrap_future(self._queue.add(message_id))
+        if not new:
+            log.debug('ignoring duplicate message %s', message_id)
+            return None
+        return await self.get_message_and_process(message_id=message_id)
+
+    async def recover(self) -> None:
+        """
+        Process all messages left unprocessed in the durable queue by a previous run
+        """
+        pending = await asyncio.wrap_future(self._queue.pending())
+        if pending:
+            log.info(f'recovering {len(pending)} unprocessed message(s)')
+        loop = asyncio.get_running_loop()
+        for message_id in pending:
+            loop.create_task(self.get_message_and_process(message_id=message_id))
+
+    async def get_message_and_process(self, message_id: str) -> Optional[Union[Future, asyncio.Future]]:
         """
         get an actual (unencrypted) message via the public API and process the message in a Thread
         :param message_id: message id
-        :return: None
+        :return: future of the processing in the thread; None if the message could not be obtained or is not processed
         """
         # get the actual (unencrypted) message via the public APIs
         # luckily we can actually pass a UUID to the public API as well :-)
-        message = await self.get_message(message_id=message_id)
+        try:
+            message = await self.get_message(message_id=message_id)
+        except Exception as e:
+            # leave the message pending; it will be processed again after a restart
+            log.error('failed to get message %s: %r', message_id, e)
+            return None
         if message is None:
-            return
+            if self._queue:
+                self._queue.done(message_id)
+            return None
 
-        # schedule execution of process(message)
-        self._executor.submit(process, message)
-        log.debug(f'scheduled processing of message: {message_id}, {message}')
+        command, _ = self.resolve_command(message.text)
+        if command is not None and self._throttle:
+            # check limits of user and room before any handler runs
+            retry = self._throttle.acquire(message.personId, message.roomId, self._commands[command].cost)
+            if retry is not None:
+                log.info('throttled command %s from %s in room %s', command, message.personEmail, message.roomId)
+                if self._throttle_reply and self._throttle.should_notify(message.personId):
+                    notice = self._delivery.send(roomId=message.roomId,
+                                                 markdown=self._throttle_reply.format(retry=retry))
+                    notice.add_done_callback(self.notice_sent)
+                if self._queue:
+                    self._queue.done(message_id)
+                return None
+
+        # schedule execution of process(message); commands with a coroutine callback are executed in the event loop
+        if command is not None and self._commands[command].execution == ASYNC:
+            future = asyncio.get_running_loop().create_task(self.process_async(message))
+        else:
+            future = self._executor.submit(self.process, message)
+        if command is not None and self._throttle:
+            future.add_done_callback(lambda f: self._throttle.release(message.personId, message.roomId))
+        if command is not None:
+            self.track(message_id, command, future)
+        if self._queue:
+            future.add_done_callback(functools.partial(self.processed, message_id))
+        log.debug('scheduled processing of message: %s, %s', message_id, message)
+        return future
+
+    @staticmethod
+    def notice_sent(future: asyncio.Future) -> None:
+        """
+        Callback for the future of a notice sent by the bot on its own, e.g. to a throttled user
+        """
+        if not future.cancelled() and future.exception() is not None:
+            log.warning('failed to send notice: %r', future.exception())
 
-    async def as_run() -> NoReturn:
+    def message_id_from_frame(self, frame: bytes) -> Optional[str]:
         """
-        find/create device registration and listen for messages on websocket. For posted messages a task is
-        scheduled to call the configured callback with the details of the posted message. This call is executed
-        in a thread so that blocking i/o in the callback does not block asynchronous handling of further messages
-        received on the websocket
+        Decode a frame received on the websocket
+        :param frame: websocket frame data
+        :return: id of the posted message if the frame is a message posted by someone else; else None
+        """
+        data = json.loads(frame.decode('utf8'))
+        data = data['data']
+        if data['eventType'] != 'conversation.activity':
+            return None
+        activity = data['activity']
+        if activity['verb'] != 'post':
+            return None
+        if activity['actor']['emailAddress'] in self._ignore_emails:
+            log.debug('ignoring message from self', extra=SAMPLED)
+            return None
+        return activity['id']
+
+    async def start_session(self) -> None:
+        """
+        Set up HTTP session and reply delivery; has to be called in the event loop before messages can be processed
         """
         self._session = aiohttp.ClientSession()
+        self._delivery = RoomDelivery(post=self.post, loop=asyncio.get_running_loop(),
+                                      url=f'{self._api_base}/messages')
+
+        if self._backend:
+            # share the caches of the demo commands with the other instances
+            share_state(SharedCache(self._backend, asyncio.get_running_loop()))
+
+        # we need to ignore messages from our own email addresses
+        me = await self.get(url=f'{self._api_base}/people/me')
+        self._ignore_emails = me['emails']
+
+    async def stop_session(self) -> None:
+        """
+        Close the HTTP session
+        """
+        await self._session.close()
+        self._session = None
+
+    def dispatch(self, message_id: str) -> None:
+        """
+        Schedule processing of a message received on the websocket
+        :param message_id: message id
+        """
         loop = asyncio.get_running_loop()
+        # create task to get message details and schedule processing
+        # we don't want to delay handling of messages on the websocket
+        if self._backend:
+            # leave processing to whichever instance takes the message from the shared work queue
+            loop.create_task(self._backend.push_work(WORK_QUEUE, message_id))
+        elif self._queue:
+            loop.create_task(self.ingest(message_id=message_id))
+        else:
+            loop.create_task(self.get_message_and_process(message_id=message_id))
+
+    async def listen(self) -> NoReturn:
+        """
+        find/create device registration and listen for messages on websocket
+        """
         while True:
             # find/create device registration
             device = await self.find_device()
@@ -219,123 +456,389 @@ def run(self) -> NoReturn:
                 log.debug('Creating new device')
                 device = await self.create_device()
 
-            # we need to ignore messages from our own email addresses
-            me = await self.get(url='https://api.ciscospark.com/v1/people/me')
-            ignore_emails = me['emails']
-
+            self.device_url = device['url']
             wss_url = device['webSocketUrl']
             log.debug(f'WSS url: {wss_url}')
+            self.connection_state = CONNECTING
             async with self._session.ws_connect(url=wss_url, headers={'Authorization': self.auth}) as wss:
+                self.connection_state = CONNECTED
+                self.connected_since = time.time()
                 async for message in wss:
-                    log.debug(f'got message from websocket: {message}')
+                    log.debug('got message from websocket: %s', message, extra=SAMPLED)
+                    self.last_frame = time.time()
+                    if self._journal:
+                        self._journal.write(journal.FRAME, message.data)
 
-                    data = json.loads(message.data.decode('utf8'))
-                    data = data['data']
-                    if data['eventType'] != 'conversation.activity':
+                    message_id = self.message_id_from_frame(message.data)
+                    if message_id is None:
                         continue
-                    activity = data['activity']
-                    if activity['verb'] != 'post':
-                        continue
-                    if activity['actor']['emailAddress'] in ignore_emails:
-                        log.debug(f'ignoring message from self')
-                        continue
-
-                    # create task to get message details and schedule processing
-                    # we don't want to delay handling of messages on the websocket
-                    message_id = activity['id']
-                    loop.create_task(get_message_and_process(message_id=message_id))
+                    self.dispatch(message_id)
                 # async for
             # async with
+            self.connection_state = DISCONNECTED
+            self.connected_since = None
         # while True
 
-    # run async code
-    asyncio.run(as_run())
+    async def lead(self) -> NoReturn:
+        """
+        Leader election: only the leader owns the device registration and listens on the websocket. Other instances
+        keep trying to become leader so that one of them takes over if the leader goes away
+        """
+        listener: Optional[asyncio.Task] = None
+        try:
+            while True:
+                leader = await self._backend.acquire_leadership(LEADER, self._instance_id, LEADER_TTL)
+                if leader and listener is None:
+                    log.info('%s: became leader', self._instance_id)
+                    listener = asyncio.get_running_loop().create_task(self.listen())
+                elif not leader and listener is not None:
+                    log.warning('%s: lost leadership', self._instance_id)
+                    listener.cancel()
+                    listener = None
+                if listener is None:
+                    self.connection_state = STANDBY
+                    self.connected_since = None
+                if listener is not None and listener.done():
+                    # websocket handling failed: raise the exception
+                    listener.result()
+                await asyncio.sleep(LEADER_TTL / 3)
+        finally:
+            if listener is not None:
+                listener.cancel()
+                await self._backend.release_leadership(LEADER, self._instance_id)
+
+    async def work(self) -> NoReturn:
+        """
+        Take message ids from the shared work queue and process them. Only takes as many messages as the executor can
+        work on so that idle instances get the rest
+        """
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self._max_in_flight)
+        while True:
+            await slots.acquire()
+            message_id = await self._backend.pop_work(WORK_QUEUE, timeout=5)
+            if message_id is None or not await self._backend.add_once(message_id, ttl=SEEN_TTL):
+                slots.release()
+                continue
+            if self._queue:
+                future = await self.ingest(message_id=message_id)
+            else:
+                future = await self.get_message_and_process(message_id=message_id)
+            if future is None:
+                slots.release()
+            else:
+                future.add_done_callback(lambda f: loop.call_soon_threadsafe(slots.release))
 
+    def run(self) -> NoReturn:
+        """
+        Actually run the bot; never returns
+        :return: never returns
+        """
 
-def add_command(self, command, help_message, callback):
-    """
-    Add a new command to the bot
-    :param command: The command string, example "/status"
-    :param help_message: A Help string for this command
-    :param callback: The function to run when this command is given
-    :return:
-    """
-    self._commands[command] = {"help": help_message, "callback": callback}
+        async def as_run() -> NoReturn:
+            """
+            find/create device registration and listen for messages on websocket. For posted messages a task is
+            scheduled to call the configured callback with the details of the posted message. This call is executed
+            in a thread so that blocking i/o in the callback does not block asynchronous handling of further messages
+            received on the websocket.
+            With a shared state backend the websocket is only handled by the leader and messages are processed by all
+            instances
+            """
+            if self._admin:
+                # start admin server first so that health checks are answered while the bot starts
+                await self._admin.start(self)
+            await self.start_session()
+            if self._queue:
+                await self.recover()
+            if self._backend is None:
+                await self.listen()
+            else:
+                await asyncio.gather(self.lead(), self.work())
 
+        # run async code
+        asyncio.run(as_run())
 
-def remove_command(self, command):
-    """
-    Remove a command from the bot
-    :param command: The command string, example "/status"
-    :return:
-    """
-    del self._commands[command]
+    def track(self, message_id: str, command: str, future: Union[Future, asyncio.Future]) -> None:
+        """
+        Keep track of a command being executed for the admin server
+        :param message_id: message id
+        :param command: command
+        :param future: future of process() or task of process_async()
+        """
+        execution = self._commands[command].execution if command in self._commands else None
+        self._in_flight[message_id] = (command, execution, time.monotonic())
 
+        def done(f) -> None:
+            # called in the executor thread for thread commands
+            entry = self._in_flight.pop(message_id, None)
+            if entry is not None:
+                now = time.monotonic()
+                self._recent.append((command, message_id, now - entry[2], time.time()))
 
-def extract_message(self, command, text):
-    """
-    Return message contents following a given command.
-    :param command: Command to search for.  Example "/echo"
-    :param text: text to search within.
-    :return:
-    """
-    cmd_loc = text.find(command)
-    message = text[cmd_loc + len(command):]
-    return message
+        future.add_done_callback(done)
+
+    def in_flight(self) -> List[Dict[str, Any]]:
+        """
+        Commands currently being executed
+        :return: list of commands with execution class and running time in seconds (includes time waiting for a
+            thread)
+        """
+        now = time.monotonic()
+        return [dict(message_id=message_id, command=command, execution=execution, running=now - started)
+                for message_id, (command, execution, started) in list(self._in_flight.items())]
 
+    def slowest_commands(self, n: int = 10) -> List[Dict[str, Any]]:
+        """
+        Slowest of the recently executed commands
+        :param n: number of commands to return
+        :return: list of commands with duration in seconds, slowest first
+        """
+        recent = sorted(list(self._recent), key=lambda r: r[2], reverse=True)[:n]
+        return [dict(command=command, message_id=message_id, duration=duration, finished=finished)
+                for command, message_id, duration, finished in recent]
 
-def set_greeting(self, callback):
-    """
-    Configure the response provided by the bot when no command is found.
-    :param callback: The function to run to create and return the greeting.
-    :return:
-    """
-    self.add_command(
-        command="/greeting", help_message="*", callback=callback
-    )
-    self.default_action = "/greeting"
+    def describe_commands(self) -> List[Dict[str, Any]]:
+        """
+        Metadata of all registered commands
+        """
+        return self._commands.describe()
 
+    def resize_pool(self, max_workers: int) -> None:
+        """
+        Change the number of threads executing commands. Commands already submitted finish in the old pool
+        :param max_workers: new pool size
+        """
+        if self._pool_size is None:
+            raise ValueError('pool size of an executor passed to BotSocket can\'t be changed')
+        if max_workers < 1:
+            raise ValueError('max_workers has to be at least 1')
+        old = self._executor
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pool_size = max_workers
+        old.shutdown(wait=False)
+
+    @property
+    def ready(self) -> bool:
+        """
+        Ready to process messages: connected to the websocket or a standby instance taking work from the shared queue
+        """
+        return self._delivery is not None and self.connection_state in (CONNECTED, STANDBY)
 
-# *** Default Commands included in Bot
-def send_help(self, message):
-    """
-    Construct a help message for users.
-    :param post_data:
-    :return:
-    """
-    message = "Hello!  "
-    message += "I understand the following commands:  \n"
-    for c in self._commands.items():
-        if c[1]["help"][0] != "*":
-            message += "* **%s**: %s \n" % (c[0], c[1]["help"])
-    return message
+    def status(self) -> Dict[str, Any]:
+        """
+        Runtime state of the bot for the admin server
+        :return: JSON serializable dict
+        """
 
+        def ratio(hits: int, misses: int) -> Dict[str, Any]:
+            total = hits + misses
+            return dict(hits=hits, misses=misses, ratio=hits / total if total else None)
+
+        in_flight = list(self._in_flight.values())
+        threads = sum(1 for _, execution, _ in in_flight if execution != ASYNC)
+        pool = dict(max_workers=self._pool_size, in_flight=threads)
+        if self._pool_size is not None:
+            pool['busy'] = min(threads, self._pool_size)
+            pool['queued'] = max(0, threads - self._pool_size)
+        return dict(
+            instance=self._instance_id,
+            ready=self.ready,
+            connection=dict(state=self.connection_state, device_url=self.device_url,
+                            connected_since=self.connected_since, last_frame=self.last_frame),
+            in_flight=dict(total=len(in_flight), threads=threads, tasks=len(in_flight) - threads),
+            pool=pool,
+            delivery_queue=self._delivery.queue_depth if self._delivery else 0,
+            caches=dict(coalesce=ratio(self._coalescer.hits, self._coalescer.misses),
+                        coalesce_async=ratio(self._async_coalescer.hits, self._async_coalescer.misses),
+                        uploads=ratio(upload_cache.hits, upload_cache.misses),
+                        help_renders=self._commands.help_renders),
+            deadline_exceeded=dict(self.deadline_exceeded),
+            throttled=self._throttle.throttled if self._throttle else None,
+            breakers={name: b.state for name, b in circuitbreaker.breakers().items()})
+
+    def call_command(self, command: str, message: webexteamssdk.Message, arguments: str) -> Optional[str]:
+        """
+        Call the callback of a command. For commands registered with a coalescing window identical calls (same command
+        and same normalized arguments) within the window are only executed once and all callers get the same reply.
+        For commands registered with a timeout the callback is executed with a deadline; if the deadline passes the
+        fallback reply of the command is returned instead
+        :param command: command to call
+        :param message: message to pass to the callback
+        :param arguments: command arguments from the message text
+        :return: reply
+        """
+        c = self._commands[command]
+        with deadline.deadline(c.timeout) as d:
+            try:
+                if not c.coalesce:
+                    return c.callback(message)
+                key = (command, ' '.join(arguments.split()))
+                if c.per_room:
+                    key = key + (message.roomId,)
+                return self._coalescer.call(key, c.coalesce, c.callback, message)
+            except Exception as e:
+                if d is None or not d.expired:
+                    raise
+                self.deadline_exceeded[command] += 1
+                log.warning('deadline exceeded for command %s: %r', command, e)
+                return c.fallback
+
+    async def call_command_async(self, command: str, message: webexteamssdk.Message, arguments: str) -> Optional[str]:
+        """
+        Same as call_command() for commands with a coroutine function as callback. The deadline of the command cancels
+        the callback
+        :param command: command to call
+        :param message: message to pass to the callback
+        :param arguments: command arguments from the message text
+        :return: reply
+        """
+        c = self._commands[command]
+        if c.coalesce:
+            key = (command, ' '.join(arguments.split()))
+            if c.per_room:
+                key = key + (message.roomId,)
+            call = self._async_coalescer.call(key, c.coalesce, c.callback, message)
+        else:
+            call = c.callback(message)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            return await asyncio.wait_for(call, timeout=c.timeout)
+        except asyncio.TimeoutError as e:
+            if c.timeout is None or loop.time() - start < c.timeout:
+                # timeout inside the callback; not the deadline of the command
+                raise
+            self.deadline_exceeded[command] += 1
+            log.warning('deadline exceeded for command %s: %r', command, e)
+            return c.fallback
+
+    def add_command(self, command, help_message, callback, coalesce: float = 0, per_room: bool = False,
+                    timeout: Optional[float] = None, fallback: Optional[str] = None, arguments: Optional[str] = None,
+                    cost: int = 1):
+        """
+        Add a new command to the bot
+        :param command: The command string, example "/status"
+        :param help_message: A Help string for this command
+        :param callback: The function to run when this command is given. Functions are executed in a thread, coroutine
+            functions in the event loop
+        :param coalesce: coalescing window in seconds; identical commands within the window are only executed once
+            and the reply is sent to all rooms asking for it. 0 disables coalescing. Only use this for commands whose
+            reply does not depend on the room or the sender
+        :param per_room: only coalesce identical commands within the same room; for non-deterministic commands
+        :param timeout: deadline in seconds for the command. A function callback needs to use deadline.timeout() for
+            outbound requests for the deadline to be effective; coroutine callbacks are cancelled
+        :param fallback: reply to send if the deadline is exceeded
+        :param arguments: usage of the command arguments shown in the help, example "[number]"
+        :param cost: cost of the command for throttling; heavy commands should declare a higher cost. Can't exceed
+            the rate limits of the throttle
+        :return:
+        """
+        if self._throttle:
+            # a command costing more than the limit would be throttled forever
+            self._throttle.check_cost(cost)
+        self._commands.add(Command(command=command, help=help_message, callback=callback, arguments=arguments,
+                                   coalesce=coalesce, per_room=per_room, timeout=timeout, fallback=fallback,
+                                   cost=cost))
+
+    @property
+    def default_action(self) -> Optional[str]:
+        """
+        command executed for messages without a command
+        """
+        return self._default_action
 
-def send_echo(self, message: webexteamssdk.Message):
-    """
-    Sample command function that just echos back the sent message
-    :param post_data:
-    :return:
-    """
-    # Get sent message
-    message = self.extract_message("/echo", message.text)
-    return message
+    def remove_command(self, command):
+        """
+        Remove a command from the bot
+        :param command: The command string, example "/status"
+        :return:
+        """
+        self._commands.remove(command)
+
+    def extract_message(self, command, text):
+        """
+        Return message contents following a given command.
+        :param command: Command to search for.  Example "/echo"
+        :param text: text to search within.
+        :return:
+        """
+        cmd_loc = text.find(command)
+        message = text[cmd_loc + len(command):]
+        return message
+
+    def set_greeting(self, callback):
+        """
+        Configure the response provided by the bot when no command is found.
+        :param callback: The function to run to create and return the greeting.
+        :return:
+        """
+        self.add_command(
+            command="/greeting", help_message="*", callback=callback
+        )
+        self._default_action = "/greeting"
+
+    # *** Default Commands included in Bot
+    def send_help(self, message):
+        """
+        Construct a help message for users. The help is only rendered again after commands have been added or removed
+        :param post_data:
+        :return:
+        """
+        return self._commands.help_markdown()
+
+    def send_echo(self, message: webexteamssdk.Message):
+        """
+        Sample command function that just echos back the sent message
+        :param post_data:
+        :return:
+        """
+        # Get sent message
+        message = self.extract_message("/echo", message.text)
+        return message
 
 
 if __name__ == '__main__':
     with open('bot_access_token', 'r') as f:
         access_token = f.readline().strip()
-    api = webexteamssdk.WebexTeamsAPI(access_token=access_token)
 
-    logging.basicConfig(level=logging.DEBUG,
-                        format='%(asctime)s %(threadName)s %(name)-12s %(levelname)-8s %(message)s')
+    # BOT_LOG_LEVEL: log level (default INFO), BOT_LOG_JSON: log JSON objects, BOT_LOG_SAMPLE: only log every n-th
+    # record of high volume debug records
+    setup_logging(level=logging.getLevelName(os.getenv('BOT_LOG_LEVEL', 'INFO').upper()),
+                  structured=bool(os.getenv('BOT_LOG_JSON')),
+                  sample_rate=int(os.getenv('BOT_LOG_SAMPLE', '1')))
     logging.getLogger('urllib3.connectionpool').setLevel(logging.INFO)
     logging.getLogger('asyncio').setLevel(logging.INFO)
-    bot = BotSocket(access_token=access_token)
-    bot.add_command('/chuck', 'get Chuck Norris joke', get_joke)
-    bot.add_command('/traffic', 'show traffic cams', functools.partial(traffic, api))
-    bot.add_command('/quote', 'get a random quote', quote)
-    bot.add_command('/number', 'get fun fact for a number', functools.partial(number, api))
-    bot.add_command('/dilbert', 'get random dilbert comic', functools.partial(dilbert, api))
-    bot.add_command('/peanuts', 'get random peanuts comic', peanuts)
+    # set BOT_JOURNAL to record websocket frames and REST calls for later replay (see replay.py)
+    journal_path = os.getenv('BOT_JOURNAL')
+    # set BOT_QUEUE to keep track of received messages in a SQLite database and process unfinished messages on restart
+    queue_path = os.getenv('BOT_QUEUE')
+    # set BOT_REDIS to a Redis URL to run multiple instances of the bot sharing the work
+    redis_url = os.getenv('BOT_REDIS')
+    # set BOT_ADMIN_PORT to serve health checks and the admin API on localhost; BOT_ADMIN_TOKEN protects the admin API
+    # and is required for adding/removing commands and resizing the pool
+    admin_port = os.getenv('BOT_ADMIN_PORT')
+    # objects which can be bound to commands added through the admin API
+    admin_context = {}
+    bot = BotSocket(access_token=access_token,
+                    throttle=Throttle(),
+                    journal=journal.Journal(journal_path, compress=True) if journal_path else None,
+                    queue=DurableQueue(queue_path) if queue_path else None,
+                    backend=RedisBackend(redis_url) if redis_url else None,
+                    admin=AdminServer(port=int(admin_port), token=os.getenv('BOT_ADMIN_TOKEN'),
+                                      context=admin_context) if admin_port else None)
+    # messages posted by the commands are queued in order with the replies of the bot
+    api = AsyncWebexAPI(access_token=access_token, send=bot.send)
+    admin_context['api'] = api
+    bot.add_command('/chuck', 'get Chuck Norris joke', get_joke, coalesce=5,
+                    timeout=10, fallback='Chuck Norris is busy right now.')
+    bot.add_command('/traffic', 'show traffic cams', functools.partial(traffic, api), cost=7,
+                    timeout=60, fallback='Sorry, the traffic cams are taking too long.')
+    bot.add_command('/quote', 'get a random quote', quote, coalesce=5,
+                    timeout=10, fallback='No quote available right now.')
+    bot.add_command('/number', 'get fun fact for a number', functools.partial(number, api), arguments='[number]',
+                    timeout=10, fallback='No fun fact available right now.')
+    bot.add_command('/dilbert', 'get random dilbert comic', functools.partial(dilbert, api), arguments='[term]',
+                    timeout=20, fallback='Sorry, dilbert.com is taking too long.')
+    bot.add_command('/peanuts', 'get random peanuts comic', functools.partial(peanuts, api),
+                    timeout=20, fallback='Sorry, peanuts.com is taking too long.')
     bot.run()
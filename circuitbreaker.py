@@ -0,0 +1,114 @@
+import threading
+import time
+import logging
+import urllib.parse
+
+import deadline
+
+from typing import Dict
+
+log = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    """
+    raised instead of calling an upstream which is known to be down
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for an upstream service.
+    closed: calls go through. After `failure_threshold` consecutive failures the breaker trips
+    open: calls fail fast with CircuitOpen. After `reset_timeout` seconds the breaker half-opens
+    half-open: a single trial call goes through (all other calls still fail fast). If the trial succeeds the breaker
+        closes, else it opens again
+
+    Use as context manager around calls to the upstream:
+        with breaker:
+            r = requests.get(...)
+    Any exception raised in the block counts as failure. Cancellation (e.g. by the deadline of an async command) and
+    DeadlineExceeded do not: the site might just be slow.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 30) -> None:
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened = 0.0
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened >= self._reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def __enter__(self) -> 'CircuitBreaker':
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened < self._reset_timeout:
+                    raise CircuitOpen(self.name)
+                self._state = self.HALF_OPEN
+                log.info(f'circuit breaker {self.name}: half-open')
+            if self._state == self.HALF_OPEN:
+                if self._trial_running:
+                    raise CircuitOpen(self.name)
+                self._trial_running = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._trial_running = False
+            if exc_type is not None and (not issubclass(exc_type, Exception) or
+                                         issubclass(exc_type, deadline.DeadlineExceeded)):
+                # cancelled (asyncio.CancelledError is a BaseException) or deadline passed; no verdict on the site
+                return
+            if exc_type is None:
+                if self._state != self.CLOSED:
+                    log.info(f'circuit breaker {self.name}: closed')
+                self._state = self.CLOSED
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self._failure_threshold:
+                if self._state != self.OPEN:
+                    log.warning(f'circuit breaker {self.name}: open after {self._failures} failure(s): {exc_val!r}')
+                self._state = self.OPEN
+                self._opened = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(url: str) -> CircuitBreaker:
+    """
+    Get the circuit breaker for the host of the given URL
+    :param url: URL
+    :return: circuit breaker
+    """
+    host = urllib.parse.urlsplit(url).hostname or url
+    with _breakers_lock:
+        b = _breakers.get(host)
+        if b is None:
+            b = CircuitBreaker(name=host)
+            _breakers[host] = b
+    return b
+
+
+def breakers() -> Dict[str, CircuitBreaker]:
+    """
+    all circuit breakers by host
+    """
+    with _breakers_lock:
+        return dict(_breakers)
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+import logging
+import deadline
+from concurrent.futures import Future
+
+from typing import Callable, Dict, Hashable, Tuple, Any, Awaitable
+
+log = logging.getLogger(__name__)
+
+
+class Coalescer:
+    """
+    Coalesce identical calls: the first call for a given key executes the function; any call with the same key
+    arriving while that call is running or within `window` seconds after it started gets the same result instead of
+    executing the function again. Failures are not shared: the failure of the first call can be caused by its deadline,
+    so calls waiting for it execute the function themselves, and later calls don't join the failed call.
+    Thread safe; meant to be used from the executor threads processing bot commands.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # key -> (end of coalescing window, future for the result)
+        self._calls: Dict[Hashable, Tuple[float, Future]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def call(self, key: Hashable, window: float, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Call a function or join an identical call started less than `window` seconds ago
+        :param key: key identifying identical calls
+        :param window: coalescing window in seconds
+        :param func: function to call
+        :return: result of the (shared) call
+        """
+        now = time.monotonic()
+        with self._lock:
+            # drop expired calls; only calls which are done can expire
+            expired = [k for k, (expires, f) in self._calls.items() if now > expires and f.done()]
+            for k in expired:
+                del self._calls[k]
+            entry = self._calls.get(key)
+            if entry is not None:
+                self.hits += 1
+                future = entry[1]
+                owner = False
+            else:
+                self.misses += 1
+                future = Future()
+                self._calls[key] = (now + window, future)
+                owner = True
+        if not owner:
+            log.debug('coalescing call for %s', key)
+            try:
+                # don't wait beyond the deadline of the current thread
+                return future.result(timeout=deadline.remaining())
+            except Exception:
+                if not future.done():
+                    # our own deadline
+                    raise
+            log.debug('coalesced call for %s failed; calling again', key)
+            return func(*args, **kwargs)
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                if self._calls.get(key, (0, None))[1] is future:
+                    del self._calls[key]
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+
+class AsyncCoalescer:
+    """
+    Coalescer for coroutine functions; to be used in the event loop
+    """
+
+    def __init__(self) -> None:
+        # key -> (end of coalescing window, task executing the call)
+        self._calls: Dict[Hashable, Tuple[float, asyncio.Future]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def call(self, key: Hashable, window: float, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Call a coroutine function or join an identical call started less than `window` seconds ago
+        :param key: key identifying identical calls
+        :param window: coalescing window in seconds
+        :param func: coroutine function to call
+        :return: result of the (shared) call
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        expired = [k for k, (expires, f) in self._calls.items() if now > expires and f.done()]
+        for k in expired:
+            del self._calls[k]
+        entry = self._calls.get(key)
+        if entry is not None and entry[1].done() and (entry[1].cancelled() or entry[1].exception() is not None):
+            # don't hand a failure to later callers
+            entry = None
+        if entry is not None:
+            self.hits += 1
+            log.debug('coalescing call for %s', key)
+            task = entry[1]
+        else:
+            self.misses += 1
+            task = loop.create_task(func(*args, **kwargs))
+            self._calls[key] = (now + window, task)
+        # cancellation of one caller (e.g. deadline) must not cancel the call shared with other callers
+        return await asyncio.shield(task)
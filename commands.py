@@ -0,0 +1,137 @@
+import asyncio
+import functools
+import threading
+from dataclasses import dataclass, field
+
+from typing import Callable, Optional, Dict, Iterator, List, Any
+
+# execution classes of commands
+THREAD = 'thread'  # callback is a function executed in the executor
+ASYNC = 'async'  # callback is a coroutine function executed in the event loop
+
+
+def is_coroutine_callback(callback: Callable) -> bool:
+    """
+    Check whether a command callback is a coroutine function (or a partial of a coroutine function)
+    """
+    while isinstance(callback, functools.partial):
+        callback = callback.func
+    return asyncio.iscoroutinefunction(callback)
+
+
+@dataclass
+class Command:
+    """
+    A bot command and its metadata
+    """
+    command: str  # command string, example "/status"
+    help: str  # help text; help texts starting with "*" are not shown in the help
+    callback: Callable
+    arguments: Optional[str] = None  # usage of the command arguments shown in the help, example "[number]"
+    coalesce: float = 0  # coalescing window in seconds
+    per_room: bool = False  # only coalesce within the same room
+    timeout: Optional[float] = None  # deadline in seconds
+    fallback: Optional[str] = None  # reply if the deadline is exceeded
+    cost: int = 1  # cost of a single call for throttling
+    execution: str = field(init=False)  # execution class: THREAD or ASYNC
+
+    def __post_init__(self) -> None:
+        self.execution = ASYNC if is_coroutine_callback(self.callback) else THREAD
+
+    @property
+    def visible(self) -> bool:
+        return not self.help.startswith('*')
+
+    def describe(self) -> Dict[str, Any]:
+        """
+        metadata as JSON serializable dict
+        """
+        return dict(command=self.command, help=self.help, arguments=self.arguments, visible=self.visible,
+                    execution=self.execution, coalesce=self.coalesce, per_room=self.per_room, timeout=self.timeout,
+                    fallback=self.fallback, cost=self.cost)
+
+
+class CommandRegistry:
+    """
+    Registry of the commands of a bot. Commands are kept in the order in which they were added; that's the order in
+    which commands are matched and listed in the help.
+    The rendered help is cached and only rendered again after commands have been added or removed.
+    The registry is read from the executor threads: modifications replace the dict of commands instead of changing it
+    so that readers always see a consistent snapshot. Modifications and caching of the help are serialized by a lock;
+    the version is incremented with each modification so that help rendered for an outdated snapshot isn't cached.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._commands: Dict[str, Command] = {}
+        self._version = 0
+        self._help: Optional[str] = None
+        self.help_renders = 0
+
+    def add(self, command: Command) -> None:
+        with self._lock:
+            commands = dict(self._commands)
+            commands[command.command] = command
+            self._commands = commands
+            self._version += 1
+            self._help = None
+
+    def remove(self, command: str) -> None:
+        with self._lock:
+            commands = dict(self._commands)
+            del commands[command]
+            self._commands = commands
+            self._version += 1
+            self._help = None
+
+    def __getitem__(self, command: str) -> Command:
+        return self._commands[command]
+
+    def __contains__(self, command: str) -> bool:
+        return command in self._commands
+
+    def __iter__(self) -> Iterator[Command]:
+        return iter(self._commands.values())
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def find(self, text: str) -> Optional[Command]:
+        """
+        Find the first command contained in a message text
+        :param text: message text
+        :return: command or None
+        """
+        for command in self._commands.values():
+            if text.find(command.command) != -1:
+                return command
+        return None
+
+    def help_markdown(self) -> str:
+        """
+        Help text listing all visible commands
+        :return: markdown
+        """
+        help_text = self._help
+        if help_text is None:
+            with self._lock:
+                commands, version = self._commands, self._version
+            # render outside of the lock
+            lines: List[str] = ["Hello!  I understand the following commands:  \n"]
+            for c in commands.values():
+                if c.visible:
+                    command = f'{c.command} {c.arguments}' if c.arguments else c.command
+                    lines.append("* **%s**: %s \n" % (command, c.help))
+            help_text = ''.join(lines)
+            with self._lock:
+                # don't cache if commands have been changed while rendering
+                if self._version == version:
+                    self._help = help_text
+                self.help_renders += 1
+        return help_text
+
+    def describe(self) -> List[Dict[str, Any]]:
+        """
+        metadata of all commands
+        """
+        return [c.describe() for c in self._commands.values()]
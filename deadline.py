@@ -0,0 +1,89 @@
+"""
+Cooperative deadlines for command handlers.
+
+A deadline is set per thread. Handlers don't need to know about the deadline of the command they are executing as long
+as they pass `timeout()` to every outbound HTTP request and call `check()` before any other potentially slow
+operation: once the deadline has passed the next such call fails and the executor thread is released.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from typing import Optional
+
+# timeout for HTTP requests if no deadline is set
+DEFAULT_TIMEOUT = 10.0
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float) -> None:
+        self.expires = time.monotonic() + seconds
+
+    @property
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining <= 0
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """
+    Context manager setting a deadline for the current thread. Nested deadlines can only shorten the deadline
+    :param seconds: time budget in seconds; None: no (additional) deadline
+    """
+    previous = getattr(_local, 'deadline', None)
+    d = previous
+    if seconds is not None:
+        d = Deadline(seconds)
+        if previous is not None and previous.expires < d.expires:
+            d = previous
+    _local.deadline = d
+    try:
+        yield d
+    finally:
+        _local.deadline = previous
+
+
+def remaining() -> Optional[float]:
+    """
+    Time left until the deadline of the current thread
+    :return: remaining time in seconds or None if no deadline is set
+    """
+    d = getattr(_local, 'deadline', None)
+    return None if d is None else d.remaining
+
+
+def expired() -> bool:
+    """
+    True if the deadline of the current thread has passed
+    """
+    r = remaining()
+    return r is not None and r <= 0
+
+
+def check() -> None:
+    """
+    raise DeadlineExceeded if the deadline of the current thread has passed
+    """
+    if expired():
+        raise DeadlineExceeded()
+
+
+def timeout(default: float = DEFAULT_TIMEOUT) -> float:
+    """
+    Timeout to be used for an outbound request: the remaining time until the deadline of the current thread
+    :param default: timeout if no deadline is set
+    :return: timeout in seconds
+    """
+    check()
+    r = remaining()
+    return default if r is None else r
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import concurrent.futures
+from collections import deque
+
+import aiohttp
+
+from typing import Callable, Awaitable, Dict, Any, Deque, Tuple
+
+log = logging.getLogger(__name__)
+
+MESSAGES_URL = 'https://api.ciscospark.com/v1/messages'
+
+# Webex rejects messages with more than 7439 bytes of text; stay below that when batching replies
+MAX_BATCH_LENGTH = 7000
+
+PostCallable = Callable[..., Awaitable[Dict[str, Any]]]
+
+
+class RoomDelivery:
+    """
+    Asynchronous delivery of messages with one send queue per room. Messages to the same room are posted in the order
+    in which they were queued; different rooms are served in parallel. Consecutive markdown-only messages queued for the
+    same room are combined into a single message.
+    Files can be posted by URL (files=[url]) or uploaded (files=(filename, content, content type)).
+    """
+
+    def __init__(self, post: PostCallable, loop: asyncio.AbstractEventLoop,
+                 url: str = MESSAGES_URL, batch: bool = True) -> None:
+        """
+        :param post: coroutine function used to post a message: post(url=..., json=...) or post(url=..., data=...)
+        :param loop: event loop in which messages are posted
+        :param url: URL to post messages to
+        :param batch: combine consecutive markdown-only messages for the same room
+        """
+        self._post = post
+        self._loop = loop
+        self._url = url
+        self._batch = batch
+        # room id -> queue of (message, future to be completed once the message is posted)
+        self._queues: Dict[str, Deque[Tuple[Dict[str, Any], asyncio.Future]]] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        number of messages queued for delivery
+        """
+        return sum(len(q) for q in self._queues.values())
+
+    def send(self, roomId: str, **message) -> asyncio.Future:
+        """
+        Queue a message for delivery; has to be called from the event loop
+        :param roomId: room id
+        :param message: message parameters, e.g. markdown=...; files=(filename, content, content type) to upload a file
+        :return: future with the posted message (or exception)
+        """
+        future = self._loop.create_future()
+        queue = self._queues.get(roomId)
+        if queue is None:
+            # no worker for this room: start one
+            queue = deque()
+            self._queues[roomId] = queue
+            self._loop.create_task(self._room_worker(roomId, queue))
+        message['roomId'] = roomId
+        queue.append((message, future))
+        return future
+
+    def send_threadsafe(self, roomId: str, **message) -> concurrent.futures.Future:
+        """
+        Queue a message for delivery from any thread; does not wait for the message to be posted
+        :param roomId: room id
+        :param message: message parameters, e.g. markdown=...
+        :return: future with the posted message (or exception)
+        """
+
+        async def send():
+            return await self.send(roomId, **message)
+
+        return asyncio.run_coroutine_threadsafe(send(), self._loop)
+
+    def _next_batch(self, queue: Deque[Tuple[Dict[str, Any], asyncio.Future]]) -> Tuple[Dict[str, Any],
+                                                                                          Tuple[asyncio.Future, ...]]:
+        """
+        Take the next message from the queue; consecutive markdown-only messages are combined
+        """
+        message, future = queue.popleft()
+        if not self._batch or set(message) != {'roomId', 'markdown'}:
+            return message, (future,)
+        parts = [message['markdown']]
+        futures = [future]
+        length = len(parts[0])
+        while queue and set(queue[0][0]) == {'roomId', 'markdown'} and \
+                length + len(queue[0][0]['markdown']) + 2 <= MAX_BATCH_LENGTH:
+            m, f = queue.popleft()
+            parts.append(m['markdown'])
+            futures.append(f)
+            length += len(m['markdown']) + 2
+        if len(parts) > 1:
+            log.debug('combined %s messages to room %s', len(parts), message['roomId'])
+        return dict(roomId=message['roomId'], markdown='\n\n'.join(parts)), tuple(futures)
+
+    @staticmethod
+    def _form(message: Dict[str, Any]) -> aiohttp.FormData:
+        """
+        multipart body for a message with a file upload
+        """
+        data = aiohttp.FormData()
+        for key, value in message.items():
+            if key == 'files':
+                filename, content, content_type = value
+                data.add_field('files', content, filename=filename, content_type=content_type)
+            else:
+                data.add_field(key, value)
+        return data
+
+    async def _room_worker(self, room_id: str, queue: Deque[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        """
+        Post all messages queued for a room; terminates once the queue is empty
+        """
+        try:
+            while queue:
+                message, futures = self._next_batch(queue)
+                try:
+                    if isinstance(message.get('files'), tuple):
+                        result = await self._post(url=self._url, data=self._form(message))
+                    else:
+                        result = await self._post(url=self._url, json=message)
+                except Exception as e:
+                    log.error('failed to post message to room %s: %s', room_id, e)
+                    for f in futures:
+                        if not f.done():
+                            f.set_exception(e)
+                else:
+                    for f in futures:
+                        if not f.done():
+                            f.set_result(result)
+        finally:
+            del self._queues[room_id]
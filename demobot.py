@@ -12,6 +12,12 @@ import urllib.parse
 import flask
 import json
 import os
+import asyncio
+import deadline
+import circuitbreaker
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+from uploadcache import UploadCache
 
 bot_email = 'demo_jkrohn@webex.bot'
 with open('bot_access_token', 'r') as f:
@@ -29,13 +35,199 @@ if False:
         teams_token = os.getenv('DEMOBOT_ACCESS_TOKEN')
         bot_app_name = os.getenv('DEMOBOT_NAME')
 
+# third party sites used by the commands
+ICNDB_URL = 'http://api.icndb.com/jokes/random'
+SNARL_CAM_URL = 'http://victoria.snarl.com.au/cams/single/{}'
+NUMBERS_URL = 'http://numbersapi.com/{number}'
+DILBERT_SEARCH_URL = 'https://dilbert.com/search_results?terms={search_param}'
+PEANUTS_URL = 'https://www.peanuts.com/comics/'
+QUOTES_URL = 'https://quotesondesign.com/wp-json/wp/v2/posts/?orderby=rand'
+MESSAGES_URL = 'https://api.ciscospark.com/v1/messages'
+
+# URLs of a few traffic cams in Germany
+GERMAN_TRAFFIC_CAMS = [
+    'http://autobahn-rlp.de/syncdata/cam/380/thumb_640x480.jpg',
+    'http://autobahn-rlp.de/syncdata/cam/385/thumb_640x480.jpg',
+    'http://autobahn-rlp.de/syncdata/cam/165/thumb_640x480.jpg'
+]
+
+# some camera IDs in Melbourne
+SNARL_CAM_IDS = [105, 107, 142, 143]
+
+# files posted to spaces recently; used to avoid uploading the same file to the same space again and again
+upload_cache = UploadCache()
+
+# cache shared with other instances of the bot (statebackend.SharedCache); see share_state()
+shared_cache = None
+
+# time for which replies kept by serve_stale() are kept in the shared cache
+STALE_TTL = 86400
+
+
+def share_state(shared):
+    """
+    Share the upload cache and the replies kept by serve_stale() with other instances of the bot
+    :param shared: statebackend.SharedCache; None to stop sharing
+    """
+    global shared_cache
+    shared_cache = shared
+    upload_cache.share(shared)
+
+
+def api_send(api):
+    """
+    Send callable posting messages directly through the API. Commands take a send callable to post messages; with
+    BotSocket that's BotSocket.send_threadsafe which queues the messages in order with the replies of the bot
+    :param api: Spark API instance
+    :return: send(roomId=..., **message) returning a (completed) future with the posted message
+    """
+
+    def send(**message):
+        future = Future()
+        future.set_result(api.messages.create(**message).json_data)
+        return future
+
+    return send
+
+
+def remember_posted(room_id, digest, future):
+    """
+    Done callback for the future of a posted file: remember the message in the upload cache
+    """
+    if future.exception() is None:
+        upload_cache.remember(room_id, digest, future.result()['id'])
+
+
+def post_file(api, room_id, file, reuse=False, send=None):
+    """
+    Post a file given by URL to a space. With reuse: if the same file has been posted to the space recently then only
+    a threaded reply to the earlier message is posted instead of uploading the file again
+    :param api: Spark API instance
+    :param room_id: room id
+    :param file: file URL
+    :param reuse: the URL identifies the content (the content behind the URL never changes). Never set this for URLs
+        of live content like traffic cams
+    :param send: send callable, see api_send(); default: post directly through the API
+    """
+    send = send or api_send(api)
+    digest = upload_cache.digest(file) if reuse else None
+    message_id = digest and upload_cache.lookup(room_id, digest)
+    deadline.check()
+    if message_id is not None:
+        send(roomId=room_id, parentId=message_id, text='Same image as posted here before.')
+        return
+    with upload_cache.upload_slot(room_id):
+        deadline.check()
+        # queued messages are posted later; no need to wait
+        posted = send(roomId=room_id, files=[file])
+    if reuse:
+        posted.add_done_callback(functools.partial(remember_posted, room_id, digest))
+
+
+def http_get(url, session=None, **kwargs):
+    """
+    GET a resource from a third party site. The request is guarded by the circuit breaker for the site and limited by
+    the deadline of the current command
+    :param url: URL
+    :param session: optional requests session to use
+    :return: response
+    """
+    timeout = deadline.timeout()
+    with circuitbreaker.breaker(url):
+        try:
+            r = (session or requests).get(url, timeout=timeout, **kwargs)
+        except requests.Timeout as e:
+            if deadline.expired():
+                # timed out b/c of the deadline of the command; not a failure of the site
+                raise deadline.DeadlineExceeded() from e
+            raise
+        # server errors count as failures of the site
+        if r.status_code >= 500:
+            r.raise_for_status()
+    return r
+
+
+def serve_stale(canned, key=None, keep=20, max_keys=1000,
+                errors=(circuitbreaker.CircuitOpen, requests.RequestException)):
+    """
+    Decorator for command handlers: remember the last good replies of the handler and serve one of those (or the canned
+    reply) if the upstream site is down. Works for sync and async handlers
+    :param canned: reply if no earlier reply is available
+    :param key: optional function to derive a cache key from the message; replies are only served for the same key
+    :param keep: number of replies to keep per key
+    :param max_keys: maximum number of keys to keep replies for; least recently used keys are dropped first
+    :param errors: exceptions indicating that the upstream site is down
+    """
+
+    def decorator(func):
+        replies = OrderedDict()
+
+        def shared_key(k):
+            return f'stale:{func.__module__}.{func.__qualname__}:{k}'
+
+        def remember(k, reply):
+            earlier = replies.setdefault(k, deque(maxlen=keep))
+            earlier.append(reply)
+            replies.move_to_end(k)
+            while len(replies) > max_keys:
+                replies.popitem(last=False)
+            if shared_cache is not None:
+                shared_cache.set(shared_key(k), json.dumps(list(earlier)), STALE_TTL)
+
+        def stale(k, e, shared=None):
+            logging.warning(f'{func.__name__}: upstream not available: {e!r}')
+            earlier = replies.get(k)
+            if not earlier and shared:
+                # replies obtained by other instances
+                earlier = json.loads(shared)
+            return random.choice(earlier) if earlier else canned
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                k = key(args[-1]) if key else None
+                try:
+                    reply = await func(*args, **kwargs)
+                except errors as e:
+                    shared = None
+                    if shared_cache is not None and not replies.get(k):
+                        shared = await shared_cache.get_async(shared_key(k))
+                    return stale(k, e, shared)
+                remember(k, reply)
+                return reply
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            message = args[-1]
+            k = key(message) if key else None
+            try:
+                reply = func(*args, **kwargs)
+            except errors as e:
+                if deadline.expired():
+                    # request timed out b/c of the deadline of the command; not a failure of the site
+                    raise
+                shared = None
+                if shared_cache is not None and not replies.get(k):
+                    shared = shared_cache.get(shared_key(k))
+                return stale(k, e, shared)
+            remember(k, reply)
+            return reply
+
+        return wrapper
+
+    return decorator
+
+
+@serve_stale('Chuck Norris is taking a break. Try again later.')
 def get_joke(message):
     # get a random Chuck Norris joke
     # r = requests.get('http://api.icndb.com/jokes/random', params = {'limitTo': '[nerdy]'})
     # params = {'firstName': 'Johannes', 'lastName': 'Krohn'}
     # r = requests.get('http://api.icndb.com/jokes/random', params=params)
 
-    r = requests.get('http://api.icndb.com/jokes/random', params={'limitTo': '[nerdy]'})
+    r = http_get(ICNDB_URL, params={'limitTo': '[nerdy]'})
     r = r.json()
     joke = r['value']['joke']
     return joke
@@ -48,11 +240,21 @@ def get_snarl_traffic_cam_image_url(camera_id):
     :return: url
     """
     # get page with traffic cam info
-    url = 'http://victoria.snarl.com.au/cams/single/{}'.format(camera_id)
-    r = requests.get(url)
+    url = SNARL_CAM_URL.format(camera_id)
+    try:
+        r = http_get(url)
+    except circuitbreaker.CircuitOpen:
+        return None
+    return snarl_image_url(r.text)
+
 
-    # parse page and extract image URL
-    soup = BeautifulSoup(r.text, 'html.parser')
+def snarl_image_url(html):
+    """
+    Extract the URL of the traffic cam image from a snarl traffic cam page
+    :param html: page
+    :return: url or None
+    """
+    soup = BeautifulSoup(html, 'html.parser')
     try:
         img = soup.find('div', id='traffic-cam-details').find('img')
     except AttributeError:
@@ -62,61 +264,70 @@ def get_snarl_traffic_cam_image_url(camera_id):
     return img['src']
 
 
-def traffic(api, message):
+def traffic(api, message, send=None):
     """
     Act on the /traffic command. Post a few traffic cam images to a Cisco Spark space
     :param api: Spark API instance
     :param message: message object
+    :param send: send callable, see api_send()
     :return: markdown of text to be posted
     """
 
-    # URLs of a few traffic cams in Germany
-    german_traffic_cams = [
-        'http://autobahn-rlp.de/syncdata/cam/380/thumb_640x480.jpg',
-        'http://autobahn-rlp.de/syncdata/cam/385/thumb_640x480.jpg',
-        'http://autobahn-rlp.de/syncdata/cam/165/thumb_640x480.jpg'
-    ]
-
-    # some camera IDs in Melbourne
-    snarl_cam_ids = [105, 107, 142, 143]
-
     room_id = message.roomId
 
     # need to post the attachments individually as the Cisco Spark API currently only supports one attachment at a time.
-    for file in german_traffic_cams:
-        api.messages.create(roomId=room_id, files=[file])
+    for file in GERMAN_TRAFFIC_CAMS:
+        post_file(api, room_id, file, send=send)
 
     # get image URLs for the given camera IDs
-    snarl_cam_urls = (get_snarl_traffic_cam_image_url(cam_id) for cam_id in snarl_cam_ids)
+    snarl_cam_urls = (get_snarl_traffic_cam_image_url(cam_id) for cam_id in SNARL_CAM_IDS)
 
     # only take the actual URLs; ignore None instances
     snarl_cam_urls = (url for url in snarl_cam_urls if url is not None)
 
     # finally post all images to the space
     for cam_url in snarl_cam_urls:
-        api.messages.create(roomId=room_id, files=[cam_url])
+        post_file(api, room_id, cam_url, send=send)
 
     return 'Traffic cam images posted above as requested'
 
-def number(api, message):
+
+def number_param(text):
     """
-    Get a fun fact for a number
+    Get the number from the text of a /number command
+    :param text: message text
+    :return: number or None
     """
-    m = re.match(r'.*/number(\s+\d+)?', message.text)
+    m = re.match(r'.*/number(\s+\d+)?', text)
     try:
-        number = m.groups()[0]
-        number = str(int(number))
+        return str(int(m.groups()[0]))
     except (TypeError, ValueError, AttributeError):
+        return None
+
+
+@serve_stale('No fun fact available right now.', key=lambda message: number_param(message.text))
+def number(api, message, send=None):
+    """
+    Get a fun fact for a number
+    """
+    number = number_param(message.text)
+    if number is None:
         number = 'random'
-        api.messages.create(roomId=message.roomId,
-                            text='No number provided. Getting fun fact for a randum number.')
+        deadline.check()
+        (send or api_send(api))(roomId=message.roomId,
+                                text='No number provided. Getting fun fact for a randum number.')
 
-    r = requests.get('http://numbersapi.com/{number}'.format(number=number))
+    r = http_get(NUMBERS_URL.format(number=number))
     return r.text
 
 
-def dilbert(api, message):
-    m = re.match(r'.*/dilbert\s+(\S+)?', message.text)
+def dilbert_param(text):
+    """
+    Get the search term from the text of a /dilbert command
+    :param text: message text
+    :return: search term
+    """
+    m = re.match(r'.*/dilbert\s+(\S+)?', text)
     try:
         search_param = m.groups()[0]
     except (TypeError, ValueError, AttributeError):
@@ -124,29 +335,46 @@ def dilbert(api, message):
 
     if search_param is None:
         search_param = 'management'
+    return search_param
+
 
-    search_url = 'https://dilbert.com/search_results?terms={search_param}'.format(search_param=search_param)
-    r = requests.get(search_url)
-    soup = BeautifulSoup(r.text, "html.parser")
+def dilbert_images(html, search_url):
+    """
+    Extract the comic image URLs from a dilbert.com search result page
+    :param html: page
+    :param search_url: URL of the page
+    :return: list of image URLs
+    """
+    soup = BeautifulSoup(html, "html.parser")
     comics = soup.find_all('div', class_='comic-item-container')
-    images = [urllib.parse.urljoin(search_url, c.attrs['data-image']) for c in comics]
+    return [urllib.parse.urljoin(search_url, c.attrs['data-image']) for c in comics]
+
+
+def dilbert(api, message, send=None):
+    search_param = dilbert_param(message.text)
+    search_url = DILBERT_SEARCH_URL.format(search_param=search_param)
+    try:
+        r = http_get(search_url)
+    except circuitbreaker.CircuitOpen:
+        return 'Sorry, dilbert.com is not available right now'
+    images = dilbert_images(r.text, search_url)
     if not images:
         message = 'Sorry, couldn\'t find any Dilbert strip for your search term \'{search_param}\''.format(
             search_param=search_param)
     else:
-        api.messages.create(roomId=message.roomId, files=[random.choice(images)])
+        # the URL of a strip identifies the strip
+        post_file(api, message.roomId, random.choice(images), reuse=True, send=send)
         message = 'Here you go..'
     return message
 
 
-def peanuts(message):
+def peanuts_images(html):
     """
-    Get a random Peanuts comic from the Peanuts web page and post that comic to the space
+    Extract the URLs of the comic images (1024 pixels wide) from the Peanuts comics page
+    :param html: page
+    :return: list of image URLs
     """
-    s = requests.Session()
-    url = 'https://www.peanuts.com/comics/'
-    r = s.get(url=url)
-    soup = BeautifulSoup(r.text, "html.parser")
+    soup = BeautifulSoup(html, "html.parser")
     comics = soup.find_all('span', class_='peanuts-comic-strip')
     images = [c.img for c in comics]
 
@@ -172,6 +400,21 @@ def peanuts(message):
     # we only want urls of 1024w images
     images = [sl.get('1024w') for sl in src_sets]
     images = [i for i in images if i is not None]
+    return images
+
+
+def peanuts(message, send=None):
+    """
+    Get a random Peanuts comic from the Peanuts web page and post that comic to the space
+    :param message: message object
+    :param send: send callable, see api_send(); default: post directly
+    """
+    s = requests.Session()
+    try:
+        r = http_get(PEANUTS_URL, session=s)
+    except circuitbreaker.CircuitOpen:
+        return 'Sorry, peanuts.com is not available right now'
+    images = peanuts_images(r.text)
 
     if images:
         # we can't post the image using the reqular message.create call b/c the url obtained above only works if the
@@ -179,8 +422,29 @@ def peanuts(message):
         # the only way to make this work ist to get the image locally and then post the attachment using a multi-part
         # mime message
         image = random.choice(images)
-        headers = dict(referer='https://www.peanuts.com/comics/')
-        r = s.get(image, headers=headers)
+        headers = dict(referer=PEANUTS_URL)
+        try:
+            r = http_get(image, session=s, headers=headers)
+        except circuitbreaker.CircuitOpen:
+            return 'Sorry, peanuts.com is not available right now'
+
+        # no need to upload the same comic again if we just posted it to the same space
+        digest = upload_cache.digest(r.content)
+        message_id = upload_cache.lookup(message.roomId, digest)
+        if message_id is not None:
+            data = {'roomId': message.roomId, 'parentId': message_id, 'text': 'Same comic as posted here before.'}
+            if send:
+                send(**data)
+                return 'How do you like that?'
+            headers = {'Authorization': 'Bearer {}'.format(teams_token)}
+            requests.post(MESSAGES_URL, json=data, headers=headers, timeout=deadline.timeout())
+            return 'How do you like that?'
+
+        if send:
+            posted = send(roomId=message.roomId, text='Here you go',
+                          files=('Image.png', r.content, r.headers['content-type']))
+            posted.add_done_callback(functools.partial(remember_posted, message.roomId, digest))
+            return 'How do you like that?'
 
         # prepare the multipart body
         data = {
@@ -193,23 +457,42 @@ def peanuts(message):
         headers = {'Content-Type': multi_part.content_type,
                    'Authorization': 'Bearer {}'.format(teams_token)}
 
-        r = requests.post('https://api.ciscospark.com/v1/messages', data=multi_part, headers=headers)
+        with upload_cache.upload_slot(message.roomId):
+            r = requests.post(MESSAGES_URL, data=multi_part, headers=headers, timeout=deadline.timeout())
+        if r.ok:
+            upload_cache.remember(message.roomId, digest, r.json()['id'])
         message = 'How do you like that?'
     else:
         message = 'Sorry, couldn\'t find any Peanuts comics'
 
     return message
 
-def quote(message):
-    r = requests.get('https://quotesondesign.com/wp-json/wp/v2/posts/?orderby=rand')
-    r = r.json()
-    r = random.choice(r)
+
+def format_quote(posts):
+    """
+    Pick a random quote from the posts returned by quotesondesign.com
+    :param posts: list of posts
+    :return: markdown
+    """
+    r = random.choice(posts)
     quote = r['content']['rendered']
     author = r['title']['rendered']
     r = f'{quote}\n\n{author}'
     return r
 
-def card_demo(api, message):
+
+@serve_stale('No quote available right now.')
+def quote(message):
+    r = http_get(QUOTES_URL)
+    return format_quote(r.json())
+
+
+def card_message(room_id):
+    """
+    Message with an adaptive card for the card demo
+    :param room_id: room id
+    :return: message
+    """
     card_json = """{
         "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
         "type": "AdaptiveCard",
@@ -414,7 +697,7 @@ def card_demo(api, message):
     }"""
     card_json=json.loads(card_json)
     data = {
-        'roomId': message.roomId,
+        'roomId': room_id,
         'text': 'simple adaptive card demo',
         'fallbackText': 'this is an adaptive card demo. Too bad your app does not support this',
         'attachments': [
@@ -424,10 +707,14 @@ def card_demo(api, message):
             }
         ]
     }
+    return data
+
+
+def card_demo(api, message):
+    data = card_message(message.roomId)
     headers = {'Authorization': f'Bearer {teams_token}'}
-    r = requests.post('https://api.ciscospark.com/v1/messages', json=data, headers=headers)
+    r = requests.post(MESSAGES_URL, json=data, headers=headers, timeout=deadline.timeout())
     return ''
-    pass
 
 def card_action(api):
     """
@@ -438,7 +725,8 @@ def card_action(api):
 
     # get the attachment
     headers = {'Authorization': f'Bearer {teams_token}'}
-    r = requests.get(f'https://api.ciscospark.com/v1/attachment/actions/{attachment_id}', headers=headers)
+    r = requests.get(f'https://api.ciscospark.com/v1/attachment/actions/{attachment_id}', headers=headers,
+                     timeout=deadline.timeout())
     r.raise_for_status()
     action = r.json()
     inputs = '\n'.join(f'{k}={v}' for k,v in action['inputs'].items())
@@ -0,0 +1,124 @@
+import sqlite3
+import threading
+import queue
+import time
+import logging
+from concurrent.futures import Future
+
+from typing import List, Tuple, Optional
+
+log = logging.getLogger(__name__)
+
+PENDING = 0
+DONE = 1
+
+
+class DurableQueue:
+    """
+    Durable record of the messages received by the bot, backed by SQLite in WAL mode.
+
+    Message ids are added when received and marked done once the reply has been posted. After a restart all ids which
+    are not done yet can be processed again (at least once processing). Adding an id which is already known reports a
+    duplicate so that no message is answered twice.
+
+    All database access happens in a single writer thread. Operations queued while a transaction is committed are
+    written in the next transaction (group commit): there is one fsync per batch and not one per message.
+    """
+
+    def __init__(self, path: str, max_batch: int = 1000, retention: float = 86400) -> None:
+        """
+        :param path: SQLite database file
+        :param max_batch: maximum number of operations per transaction
+        :param retention: time in seconds for which ids of processed messages are kept to detect duplicates
+        """
+        self._path = path
+        self._max_batch = max_batch
+        self._retention = retention
+        self._ops: 'queue.Queue[Optional[Tuple[str, Optional[str], Future]]]' = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, name='DurableQueue', daemon=True)
+        self._thread.start()
+
+    def add(self, message_id: str) -> Future:
+        """
+        Record a received message
+        :param message_id: message id
+        :return: future; result is True once the id is committed, False if the id is a duplicate
+        """
+        return self._submit('add', message_id)
+
+    def done(self, message_id: str) -> Future:
+        """
+        Mark a message as processed
+        :param message_id: message id
+        :return: future; completed once committed
+        """
+        return self._submit('done', message_id)
+
+    def pending(self) -> Future:
+        """
+        Get ids of all messages which have not been processed yet
+        :return: future; result is list of message ids in the order they were received
+        """
+        return self._submit('pending', None)
+
+    def close(self) -> None:
+        """
+        commit outstanding operations and stop the writer thread
+        """
+        self._ops.put(None)
+        self._thread.join()
+
+    def _submit(self, op: str, message_id: Optional[str]) -> Future:
+        future = Future()
+        self._ops.put((op, message_id, future))
+        return future
+
+    def _writer(self) -> None:
+        db = sqlite3.connect(self._path, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=FULL')
+        db.execute('CREATE TABLE IF NOT EXISTS messages '
+                   '(id TEXT PRIMARY KEY, state INTEGER NOT NULL, received REAL NOT NULL)')
+        db.execute('CREATE INDEX IF NOT EXISTS messages_state ON messages (state, received)')
+        last_cleanup = 0.0
+        stop = False
+        while not stop:
+            # block for the 1st operation and then take everything else which is queued already
+            batch = [self._ops.get()]
+            while len(batch) < self._max_batch:
+                try:
+                    batch.append(self._ops.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stop = True
+                batch = [op for op in batch if op is not None]
+            now = time.time()
+            results = []
+            try:
+                db.execute('BEGIN')
+                for op, message_id, future in batch:
+                    if op == 'add':
+                        cursor = db.execute('INSERT OR IGNORE INTO messages (id, state, received) VALUES (?, ?, ?)',
+                                            (message_id, PENDING, now))
+                        results.append(cursor.rowcount == 1)
+                    elif op == 'done':
+                        db.execute('UPDATE messages SET state=? WHERE id=?', (DONE, message_id))
+                        results.append(None)
+                    else:
+                        results.append([r[0] for r in db.execute('SELECT id FROM messages WHERE state=? '
+                                                                 'ORDER BY received', (PENDING,))])
+                if now - last_cleanup > 60:
+                    db.execute('DELETE FROM messages WHERE state=? AND received<?', (DONE, now - self._retention))
+                    last_cleanup = now
+                db.execute('COMMIT')
+            except Exception as e:
+                log.error(f'durable queue: failed to commit {len(batch)} operation(s): {e}')
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+        db.close()
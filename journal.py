@@ -0,0 +1,94 @@
+"""
+Append-only journal of the traffic of a bot: frames received on the websocket and REST calls.
+
+Each record is a fixed size header followed by the payload:
+    length of payload (uint32), timestamp (double, seconds since epoch), record kind (uint8), flags (uint8)
+Payloads can optionally be compressed with zlib.
+"""
+import struct
+import threading
+import time
+import zlib
+import logging
+from typing import NamedTuple, Iterator, BinaryIO, Optional
+
+log = logging.getLogger(__name__)
+
+# record kinds
+FRAME = 1  # frame received on the websocket
+REST = 2  # REST call: JSON with method, url, status, request and response
+
+# flags
+COMPRESSED = 1
+
+HEADER = struct.Struct('>IdBB')
+
+
+class Record(NamedTuple):
+    timestamp: float
+    kind: int
+    payload: bytes
+
+
+class Journal:
+    """
+    Writer for a journal file
+    """
+
+    def __init__(self, path: str, compress: bool = False) -> None:
+        """
+        :param path: journal file; new records are appended
+        :param compress: compress payloads
+        """
+        self._file: BinaryIO = open(path, 'ab')
+        self._compress = compress
+        self._lock = threading.Lock()
+
+    def write(self, kind: int, payload: bytes, timestamp: Optional[float] = None) -> None:
+        """
+        Append a record to the journal
+        :param kind: record kind
+        :param payload: payload
+        :param timestamp: timestamp; default: now
+        """
+        flags = 0
+        if self._compress:
+            payload = zlib.compress(payload)
+            flags |= COMPRESSED
+        header = HEADER.pack(len(payload), time.time() if timestamp is None else timestamp, kind, flags)
+        with self._lock:
+            self._file.write(header)
+            self._file.write(payload)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self) -> 'Journal':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def read_journal(path: str) -> Iterator[Record]:
+    """
+    Read all records from a journal file. A truncated record at the end of the file (process died while writing) is
+    ignored
+    :param path: journal file
+    :return: records
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            length, timestamp, kind, flags = HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                log.warning(f'truncated record at end of journal {path}')
+                break
+            if flags & COMPRESSED:
+                payload = zlib.decompress(payload)
+            yield Record(timestamp=timestamp, kind=kind, payload=payload)
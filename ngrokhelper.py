@@ -5,6 +5,7 @@ import requests
 import time
 import subprocess
 import logging
+from botlogging import SAMPLED
 
 log = logging.getLogger(__name__)
 
@@ -155,5 +156,5 @@ class NgrokHelper(threading.Thread):
         # continuously read from the ngrok process output to prevent the process from blocking
         while True:
             line = self.read_json_from_ngrok()
-            logging.debug(f'JSON message from ngrok: {line}')
+            log.debug('JSON message from ngrok: %s', line, extra=SAMPLED)
         return
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""
+Replay a journal recorded by BotSocket through the real dispatch pipeline against a local stand-in for the Webex API.
+Gives repeatable throughput and latency figures based on the shape of real traffic:
+
+    python replay.py bot.journal --speed 10
+
+Latency is measured from feeding a frame to the stand-in receiving a reply for the room of the message. Replies are
+matched to messages in order per room; if the bot combines several replies into one message only the oldest message
+of the room is matched.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict, deque
+
+from aiohttp import web
+from typing import Dict, Any, List, Optional, Deque
+
+import journal
+from botsocket import BotSocket
+
+log = logging.getLogger(__name__)
+
+
+class StandInAPI:
+    """
+    Minimal local stand-in for the Webex API: serves messages and the bot identity from a journal and accepts posted
+    messages
+    """
+
+    def __init__(self, messages: Dict[str, Dict[str, Any]], me: Dict[str, Any]) -> None:
+        """
+        :param messages: message details by message id
+        :param me: response for GET people/me
+        """
+        self._messages = messages
+        self._me = me
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ''
+        # time at which a message was fed into the bot, by message id
+        self.fed: Dict[str, float] = {}
+        # feed times of messages fetched by the bot and not yet answered, by room
+        self._pending: Dict[str, Deque[float]] = defaultdict(deque)
+        self.latencies: List[float] = []
+        self.replies = 0
+        self.last_reply = 0.0
+
+    async def start(self) -> str:
+        """
+        start the stand-in on a free local port
+        :return: API base URL
+        """
+        app = web.Application()
+        app.router.add_get('/v1/people/me', self._get_me)
+        app.router.add_get('/v1/messages/{message_id}', self._get_message)
+        app.router.add_post('/v1/messages', self._post_message)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host='127.0.0.1', port=0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f'http://127.0.0.1:{port}/v1'
+        return self.base_url
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+    async def _get_me(self, request: web.Request) -> web.Response:
+        return web.json_response(self._me)
+
+    async def _get_message(self, request: web.Request) -> web.Response:
+        message_id = request.match_info['message_id']
+        message = self._messages.get(message_id)
+        if message is None:
+            # frame w/o a recorded message; fall back to the default action
+            message = dict(id=message_id, roomId='replay', personEmail='user@replay', text='')
+        fed = self.fed.get(message_id)
+        if fed is not None:
+            self._pending[message['roomId']].append(fed)
+        return web.json_response(message)
+
+    async def _post_message(self, request: web.Request) -> web.Response:
+        message = await request.json()
+        now = time.perf_counter()
+        self.replies += 1
+        self.last_reply = now
+        pending = self._pending.get(message['roomId'])
+        if pending:
+            self.latencies.append(now - pending.popleft())
+        message['id'] = str(uuid.uuid4())
+        return web.json_response(message)
+
+
+def load_journal(path: str):
+    """
+    Read a journal
+    :param path: journal file
+    :return: tuple of: frames (timestamp, data), messages by id, response to GET people/me
+    """
+    frames = []
+    messages = {}
+    me = dict(emails=['bot@replay'])
+    for record in journal.read_journal(path):
+        if record.kind == journal.FRAME:
+            frames.append((record.timestamp, record.payload))
+        elif record.kind == journal.REST:
+            call = json.loads(record.payload.decode('utf8'))
+            if call['method'] != 'GET' or call['status'] != 200:
+                continue
+            if '/messages/' in call['url']:
+                messages[call['url'].rsplit('/', 1)[-1]] = json.loads(call['response'])
+            elif call['url'].endswith('/people/me'):
+                me = json.loads(call['response'])
+    return frames, messages, me
+
+
+async def replay(path: str, bot_factory, speed: float = 1.0, settle: float = 1.0) -> Dict[str, Any]:
+    """
+    Replay a journal
+    :param path: journal file
+    :param bot_factory: callable returning a BotSocket instance for a given API base URL
+    :param speed: replay speed relative to the recorded timing; 0: as fast as possible
+    :param settle: time w/o new replies after which the replay is considered complete
+    :return: statistics
+    """
+    frames, messages, me = load_journal(path)
+    stand_in = StandInAPI(messages=messages, me=me)
+    bot: BotSocket = bot_factory(await stand_in.start())
+    await bot.start_session()
+    loop = asyncio.get_running_loop()
+    fed = 0
+    start = time.perf_counter()
+    try:
+        first = frames[0][0] if frames else 0
+        for timestamp, data in frames:
+            if speed > 0:
+                delay = (timestamp - first) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            message_id = bot.message_id_from_frame(data)
+            if message_id is None:
+                continue
+            fed += 1
+            stand_in.fed[message_id] = time.perf_counter()
+            loop.create_task(bot.get_message_and_process(message_id=message_id))
+        # wait for replies to stop coming in
+        while True:
+            replies = stand_in.replies
+            await asyncio.sleep(settle)
+            if stand_in.replies == replies:
+                break
+    finally:
+        await bot.stop_session()
+        await stand_in.stop()
+    end = stand_in.last_reply or time.perf_counter()
+    elapsed = max(end - start, 1e-9)
+    latencies = sorted(stand_in.latencies)
+
+    def percentile(p: float) -> Optional[float]:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+
+    return dict(frames=len(frames), messages=fed, replies=stand_in.replies, elapsed=elapsed,
+                throughput=fed / elapsed,
+                latency_p50=percentile(0.5), latency_p90=percentile(0.9), latency_p99=percentile(0.99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a BotSocket journal against a local stand-in API')
+    parser.add_argument('journal', help='journal file')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed relative to recorded timing; 0: as fast as possible')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    stats = asyncio.run(replay(args.journal,
+                               bot_factory=lambda base_url: BotSocket(access_token='replay', api_base=base_url),
+                               speed=args.speed))
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
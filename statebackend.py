@@ -0,0 +1,274 @@
+"""
+Shared state for running multiple BotSocket instances for the same bot identity.
+
+One instance (the leader) owns the device registration and the websocket and distributes the received message ids
+through a shared work queue; all instances (including the leader) take message ids from the work queue and process
+them. The backend also provides shared caches and duplicate detection for message ids.
+
+MemoryBackend keeps everything in the process and is what a single instance effectively does anyway. RedisBackend
+shares state through a Redis (or Redis compatible) server; it requires the optional `redis` package.
+
+SharedCache makes the cache of a backend usable from the executor threads as well.
+"""
+import asyncio
+import concurrent.futures
+import heapq
+import logging
+import time
+
+from typing import Optional, Dict, Tuple, List
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+log = logging.getLogger(__name__)
+
+
+class StateBackend:
+    """
+    Interface of a shared state backend
+    """
+
+    async def acquire_leadership(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Acquire or renew leadership
+        :param name: name of the leadership
+        :param owner: id of the instance trying to become (or stay) leader
+        :param ttl: leadership expires if not renewed within ttl seconds
+        :return: True if owner is the leader
+        """
+        raise NotImplementedError
+
+    async def release_leadership(self, name: str, owner: str) -> None:
+        """
+        Give up leadership if held by owner
+        """
+        raise NotImplementedError
+
+    async def push_work(self, queue: str, item: str) -> None:
+        """
+        Add an item to a work queue
+        """
+        raise NotImplementedError
+
+    async def pop_work(self, queue: str, timeout: float) -> Optional[str]:
+        """
+        Take the oldest item from a work queue
+        :param queue: work queue
+        :param timeout: time to wait for an item
+        :return: item or None on timeout
+        """
+        raise NotImplementedError
+
+    async def cache_get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def cache_set(self, key: str, value: str, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def add_once(self, key: str, ttl: float) -> bool:
+        """
+        Mark a key as seen
+        :param key: key
+        :param ttl: time for which the key is remembered
+        :return: True if the key has not been seen before
+        """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """
+    State backend for a single process
+    """
+
+    def __init__(self) -> None:
+        self._leaders: Dict[str, Tuple[str, float]] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        # key -> (value, expires)
+        self._cache: Dict[str, Tuple[Optional[str], float]] = {}
+        # heap of (expires, key) to drop expired keys; entries of keys which have been set again are skipped
+        self._expiry: List[Tuple[float, str]] = []
+
+    def _expire(self, now: float) -> None:
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, key = heapq.heappop(self._expiry)
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] == expires:
+                del self._cache[key]
+
+    def _get(self, key: str, now: float) -> Optional[Tuple[Optional[str], float]]:
+        entry = self._cache.get(key)
+        return entry if entry is not None and entry[1] > now else None
+
+    def _set(self, key: str, value: Optional[str], expires: float) -> None:
+        self._cache[key] = (value, expires)
+        heapq.heappush(self._expiry, (expires, key))
+
+    def _queue(self, queue: str) -> asyncio.Queue:
+        q = self._queues.get(queue)
+        if q is None:
+            q = asyncio.Queue()
+            self._queues[queue] = q
+        return q
+
+    async def acquire_leadership(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.monotonic()
+        current = self._leaders.get(name)
+        if current is not None and current[0] != owner and current[1] > now:
+            return False
+        self._leaders[name] = (owner, now + ttl)
+        return True
+
+    async def release_leadership(self, name: str, owner: str) -> None:
+        current = self._leaders.get(name)
+        if current is not None and current[0] == owner:
+            del self._leaders[name]
+
+    async def push_work(self, queue: str, item: str) -> None:
+        self._queue(queue).put_nowait(item)
+
+    async def pop_work(self, queue: str, timeout: float) -> Optional[str]:
+        try:
+            return await asyncio.wait_for(self._queue(queue).get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def cache_get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._get(f'cache:{key}', now)
+        return None if entry is None else entry[0]
+
+    async def cache_set(self, key: str, value: str, ttl: float) -> None:
+        now = time.monotonic()
+        self._expire(now)
+        self._set(f'cache:{key}', value, now + ttl)
+
+    async def add_once(self, key: str, ttl: float) -> bool:
+        now = time.monotonic()
+        self._expire(now)
+        key = f'seen:{key}'
+        if self._get(key, now) is not None:
+            return False
+        self._set(key, None, now + ttl)
+        return True
+
+
+class RedisBackend(StateBackend):
+    """
+    State backend shared through a Redis server
+    """
+    # renew the leadership only if still held by the owner
+    _RENEW = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('pexpire', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    # release the leadership only if held by the owner
+    _RELEASE = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, url: str = 'redis://localhost:6379/0', prefix: str = 'botsocket:', client=None) -> None:
+        """
+        :param url: Redis URL
+        :param prefix: prefix for all keys
+        :param client: existing redis.asyncio client (created with decode_responses=True) to use instead of the URL
+        """
+        if client is None:
+            if aioredis is None:
+                raise ImportError('RedisBackend requires the redis package: pip install redis')
+            client = aioredis.from_url(url, decode_responses=True)
+        self._redis = client
+        self._prefix = prefix
+
+    async def acquire_leadership(self, name: str, owner: str, ttl: float) -> bool:
+        key = f'{self._prefix}leader:{name}'
+        ttl_ms = int(ttl * 1000)
+        if await self._redis.set(key, owner, nx=True, px=ttl_ms):
+            return True
+        return bool(await self._redis.eval(self._RENEW, 1, key, owner, ttl_ms))
+
+    async def release_leadership(self, name: str, owner: str) -> None:
+        await self._redis.eval(self._RELEASE, 1, f'{self._prefix}leader:{name}', owner)
+
+    async def push_work(self, queue: str, item: str) -> None:
+        await self._redis.lpush(f'{self._prefix}queue:{queue}', item)
+
+    async def pop_work(self, queue: str, timeout: float) -> Optional[str]:
+        # BRPOP only supports a timeout in whole seconds with older servers
+        r = await self._redis.brpop(f'{self._prefix}queue:{queue}', timeout=max(1, int(timeout)))
+        return None if r is None else r[1]
+
+    async def cache_get(self, key: str) -> Optional[str]:
+        return await self._redis.get(f'{self._prefix}cache:{key}')
+
+    async def cache_set(self, key: str, value: str, ttl: float) -> None:
+        await self._redis.set(f'{self._prefix}cache:{key}', value, px=int(ttl * 1000))
+
+    async def add_once(self, key: str, ttl: float) -> bool:
+        return bool(await self._redis.set(f'{self._prefix}seen:{key}', 1, nx=True, px=int(ttl * 1000)))
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+
+class SharedCache:
+    """
+    Access to the cache of a state backend from the event loop and from other threads. Reads from other threads wait
+    for the result for at most `timeout` seconds; writes never wait. Errors of the backend are logged and treated as
+    cache misses: shared caches are an optimization
+    """
+
+    def __init__(self, backend: StateBackend, loop: asyncio.AbstractEventLoop, timeout: float = 1) -> None:
+        """
+        :param backend: state backend
+        :param loop: event loop the backend is used in
+        :param timeout: maximum time to wait for a read from another thread
+        """
+        self._backend = backend
+        self._loop = loop
+        self._timeout = timeout
+
+    async def get_async(self, key: str) -> Optional[str]:
+        """
+        Read a value; to be called from the event loop
+        """
+        try:
+            return await self._backend.cache_get(key)
+        except Exception as e:
+            log.warning('shared cache: failed to get %s: %r', key, e)
+            return None
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Read a value; to be called from any thread but the one running the event loop
+        """
+        future = asyncio.run_coroutine_threadsafe(self.get_async(key), self._loop)
+        try:
+            return future.result(timeout=self._timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            log.warning('shared cache: timeout getting %s', key)
+            return None
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        """
+        Write a value in the background; can be called from any thread
+        """
+        asyncio.run_coroutine_threadsafe(self._set(key, value, ttl), self._loop)
+
+    async def _set(self, key: str, value: str, ttl: float) -> None:
+        try:
+            await self._backend.cache_set(key, value, ttl)
+        except Exception as e:
+            log.warning('shared cache: failed to set %s: %r', key, e)
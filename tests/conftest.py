@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+@pytest.fixture
+def access_token(tmp_path, monkeypatch):
+    """
+    dummy access token in the current directory; demobot reads the access token from there when imported
+    """
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'bot_access_token').write_text('token')
+    return 'token'
+
+
+@pytest.fixture
+def bot(access_token):
+    """
+    BotSocket with a dummy token
+    """
+    from botsocket import BotSocket
+    bot = BotSocket(access_token=access_token)
+    yield bot
+    bot._executor.shutdown()
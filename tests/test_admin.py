@@ -0,0 +1,106 @@
+import asyncio
+
+import aiohttp
+
+from admin import AdminServer
+
+
+class Bot:
+    """
+    stand-in for BotSocket
+    """
+
+    default_action = '/help'
+
+    def __init__(self) -> None:
+        self.commands = {'/help': None}
+        self.options = {}
+
+    def add_command(self, command, help_message, callback, **options):
+        self.commands[command] = callback
+        self.options[command] = options
+
+    def remove_command(self, command):
+        del self.commands[command]
+
+    def describe_commands(self):
+        return sorted(self.commands)
+
+
+async def call(admin: AdminServer, method: str, path: str, token=None, **kwargs):
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    async with aiohttp.ClientSession() as session:
+        async with session.request(method, f'http://127.0.0.1:{admin.port}{path}', headers=headers, **kwargs) as r:
+            return r.status
+
+
+def test_no_changes_without_token():
+    async def test():
+        admin = AdminServer(port=0)
+        await admin.start(Bot())
+        try:
+            assert await call(admin, 'GET', '/health/live') == 200
+            assert await call(admin, 'POST', '/commands',
+                              json=dict(command='/x', help='x', callback='operator:itemgetter')) == 405
+            assert await call(admin, 'PUT', '/pool', json=dict(max_workers=8)) == 404
+        finally:
+            await admin.stop()
+
+    asyncio.run(test())
+
+
+def test_add_command():
+    async def test():
+        bot = Bot()
+        admin = AdminServer(port=0, token='secret', modules=('operator',))
+        await admin.start(bot)
+        try:
+            command = dict(command='/x', help='x', callback='operator:itemgetter')
+            assert await call(admin, 'POST', '/commands', json=command) == 401
+            assert await call(admin, 'POST', '/commands', token='secret', json=command) == 201
+            assert '/x' in bot.commands
+            # only from allowed modules
+            command = dict(command='/y', help='y', callback='os:system')
+            assert await call(admin, 'POST', '/commands', token='secret', json=command) == 400
+            assert '/y' not in bot.commands
+        finally:
+            await admin.stop()
+
+    asyncio.run(test())
+
+
+def test_option_types():
+    async def test():
+        bot = Bot()
+        admin = AdminServer(port=0, token='secret', modules=('operator',))
+        await admin.start(bot)
+        try:
+            command = dict(command='/x', help='x', callback='operator:itemgetter', timeout=5, cost=2, per_room=True)
+            assert await call(admin, 'POST', '/commands', token='secret', json=command) == 201
+            assert bot.options['/x'] == dict(timeout=5.0, cost=2, per_room=True)
+            for option in (dict(timeout='5'), dict(cost=1.5), dict(per_room='false'), dict(coalesce=None)):
+                command = dict(command='/y', help='y', callback='operator:itemgetter', **option)
+                assert await call(admin, 'POST', '/commands', token='secret', json=command) == 400
+            assert '/y' not in bot.commands
+        finally:
+            await admin.stop()
+
+    asyncio.run(test())
+
+
+def test_remove_command():
+    async def test():
+        bot = Bot()
+        bot.commands['/x'] = None
+        admin = AdminServer(port=0, token='secret')
+        await admin.start(bot)
+        try:
+            assert await call(admin, 'DELETE', '/commands?command=/x', token='secret') == 200
+            assert await call(admin, 'DELETE', '/commands?command=/x', token='secret') == 404
+            # the default action stays
+            assert await call(admin, 'DELETE', '/commands?command=/help', token='secret') == 409
+            assert '/help' in bot.commands
+        finally:
+            await admin.stop()
+
+    asyncio.run(test())
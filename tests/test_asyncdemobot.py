@@ -0,0 +1,37 @@
+import asyncio
+
+import webexteamssdk
+
+
+def test_traffic_cancels_page_requests(access_token, monkeypatch):
+    # demobot needs the access token when imported
+    import asyncdemobot
+
+    cancelled = []
+
+    async def get_page(camera_id):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(camera_id)
+            raise
+
+    async def post_file(api, room_id, file, reuse=False):
+        await asyncio.sleep(0.01)
+        raise RuntimeError('post failed')
+
+    monkeypatch.setattr(asyncdemobot, 'get_snarl_traffic_cam_image_url', get_page)
+    monkeypatch.setattr(asyncdemobot, 'post_file', post_file)
+
+    async def test():
+        message = webexteamssdk.Message(dict(roomId='room', text='/traffic'))
+        try:
+            await asyncdemobot.traffic(None, message)
+        except RuntimeError:
+            pass
+        # let the cancellation reach the page requests
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    asyncio.run(test())
+    assert len(cancelled) == len(asyncdemobot.demobot.SNARL_CAM_IDS)
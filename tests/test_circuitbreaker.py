@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+import deadline
+from circuitbreaker import CircuitBreaker, CircuitOpen
+
+
+def test_opens_after_failures():
+    breaker = CircuitBreaker('site', failure_threshold=3)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            with breaker:
+                raise ValueError()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        with breaker:
+            pass
+
+
+def test_cancellation_is_no_failure():
+    breaker = CircuitBreaker('site', failure_threshold=3)
+
+    async def slow_call():
+        with breaker:
+            await asyncio.sleep(1)
+
+    async def test():
+        for _ in range(5):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(slow_call(), timeout=0.01)
+
+    asyncio.run(test())
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_deadline_exceeded_is_no_failure():
+    breaker = CircuitBreaker('site', failure_threshold=3)
+    for _ in range(5):
+        with pytest.raises(deadline.DeadlineExceeded):
+            with breaker:
+                raise deadline.DeadlineExceeded()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_trial_call():
+    breaker = CircuitBreaker('site', failure_threshold=1, reset_timeout=0)
+    with pytest.raises(ValueError):
+        with breaker:
+            raise ValueError()
+
+    async def slow_call():
+        with breaker:
+            await asyncio.sleep(1)
+
+    async def test():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(slow_call(), timeout=0.01)
+
+    asyncio.run(test())
+    # the cancelled trial call doesn't block the next trial call
+    with breaker:
+        pass
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from coalesce import Coalescer, AsyncCoalescer
+
+
+def test_waiters_share_result():
+    coalescer = Coalescer()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def func():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(coalescer.call('key', 10, func)))
+    owner.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(coalescer.call('key', 10, func))) for _ in range(3)]
+    for t in waiters:
+        t.start()
+    release.set()
+    for t in [owner] + waiters:
+        t.join(5)
+    assert results == ['result'] * 4
+    assert len(calls) == 1
+    assert (coalescer.hits, coalescer.misses) == (3, 1)
+
+
+def test_window_expiry():
+    coalescer = Coalescer()
+    counter = iter(range(10))
+    assert coalescer.call('key', 0.05, lambda: next(counter)) == 0
+    # within the window: result is reused
+    assert coalescer.call('key', 0.05, lambda: next(counter)) == 0
+    time.sleep(0.1)
+    assert coalescer.call('key', 0.05, lambda: next(counter)) == 1
+
+
+def test_per_room_keys():
+    coalescer = Coalescer()
+    counter = iter(range(10))
+    assert coalescer.call(('/joke', 'room 1'), 10, lambda: next(counter)) == 0
+    assert coalescer.call(('/joke', 'room 2'), 10, lambda: next(counter)) == 1
+    assert coalescer.call(('/joke', 'room 1'), 10, lambda: next(counter)) == 0
+
+
+def test_waiter_calls_again_after_owner_fails():
+    coalescer = Coalescer()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('failed')
+
+    errors = []
+
+    def owner():
+        try:
+            coalescer.call('key', 10, fail)
+        except RuntimeError as e:
+            errors.append(e)
+
+    t = threading.Thread(target=owner)
+    t.start()
+    started.wait(5)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(coalescer.call('key', 10, lambda: 'result')))
+    waiter.start()
+    # give the waiter time to join the running call
+    time.sleep(0.05)
+    release.set()
+    t.join(5)
+    waiter.join(5)
+    assert len(errors) == 1
+    assert results == ['result']
+    # the failed call is not kept for later callers
+    assert coalescer.call('key', 10, lambda: 'later') == 'later'
+
+
+def test_async_waiters_share_result():
+    coalescer = AsyncCoalescer()
+    calls = []
+
+    async def func():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def main():
+        return await asyncio.gather(*(coalescer.call('key', 10, func) for _ in range(4)))
+
+    assert asyncio.run(main()) == ['result'] * 4
+    assert len(calls) == 1
+    assert (coalescer.hits, coalescer.misses) == (3, 1)
+
+
+def test_async_window_expiry_and_per_room_keys():
+    coalescer = AsyncCoalescer()
+    counter = iter(range(10))
+
+    async def func():
+        return next(counter)
+
+    async def main():
+        results = [await coalescer.call(('/joke', 'room 1'), 0.05, func),
+                   await coalescer.call(('/joke', 'room 1'), 0.05, func),
+                   await coalescer.call(('/joke', 'room 2'), 0.05, func)]
+        await asyncio.sleep(0.1)
+        results.append(await coalescer.call(('/joke', 'room 1'), 0.05, func))
+        return results
+
+    assert asyncio.run(main()) == [0, 0, 1, 2]
+
+
+def test_async_failure_not_shared_with_later_callers():
+    coalescer = AsyncCoalescer()
+
+    async def fail():
+        raise RuntimeError('failed')
+
+    async def succeed():
+        return 'result'
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await coalescer.call('key', 10, fail)
+        return await coalescer.call('key', 10, succeed)
+
+    assert asyncio.run(main()) == 'result'
+
+
+def test_async_cancelled_caller_does_not_cancel_shared_call():
+    coalescer = AsyncCoalescer()
+
+    async def func():
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    async def main():
+        first = asyncio.ensure_future(coalescer.call('key', 10, func))
+        second = asyncio.ensure_future(coalescer.call('key', 10, func))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == 'result'
@@ -0,0 +1,40 @@
+from commands import Command, CommandRegistry
+
+
+def command(name: str) -> Command:
+    return Command(command=name, help=f'{name[1:]} help', callback=lambda message: None)
+
+
+def test_help_cached():
+    registry = CommandRegistry()
+    registry.add(command('/a'))
+    assert registry.help_markdown() is registry.help_markdown()
+    assert registry.help_renders == 1
+    registry.add(command('/b'))
+    assert '**/b**' in registry.help_markdown()
+    assert registry.help_renders == 2
+    registry.remove('/a')
+    assert '**/a**' not in registry.help_markdown()
+
+
+def test_help_not_cached_if_changed_while_rendering():
+    registry = CommandRegistry()
+
+    class Changing(Command):
+        @property
+        def visible(self) -> bool:
+            # another thread adds a command while the help is rendered
+            if '/b' not in registry:
+                registry.add(command('/b'))
+            return True
+
+    registry.add(Changing(command='/a', help='a help', callback=lambda message: None))
+    assert '**/b**' not in registry.help_markdown()
+    # the outdated help has not been cached
+    assert '**/b**' in registry.help_markdown()
+
+
+def test_removed_default_action(bot):
+    assert bot.resolve_command('hello') == ('/help', 'hello')
+    bot.remove_command('/help')
+    assert bot.resolve_command('hello') == (None, 'hello')
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+import webexteamssdk
+
+import deadline
+
+
+def test_nested_deadlines_only_shorten():
+    assert deadline.remaining() is None
+    with deadline.deadline(10):
+        with deadline.deadline(100):
+            assert deadline.remaining() <= 10
+        with deadline.deadline(1):
+            assert deadline.remaining() <= 1
+        with deadline.deadline(None):
+            assert 1 < deadline.remaining() <= 10
+        assert 1 < deadline.remaining() <= 10
+    assert deadline.remaining() is None
+
+
+def test_timeout():
+    assert deadline.timeout(default=5) == 5
+    with deadline.deadline(0.05):
+        assert 0 < deadline.timeout() <= 0.05
+        time.sleep(0.1)
+        assert deadline.expired()
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.timeout()
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.check()
+
+
+def message(text: str) -> webexteamssdk.Message:
+    return webexteamssdk.Message(dict(id='message', roomId='room', personEmail='user@example.com', text=text))
+
+
+def test_call_command_fallback(bot):
+    def slow(m):
+        time.sleep(0.1)
+        deadline.check()
+        return 'reply'
+
+    bot.add_command('/slow', 'slow', slow, timeout=0.05, fallback='try again later')
+    assert bot.call_command('/slow', message('/slow'), '') == 'try again later'
+    assert bot.deadline_exceeded['/slow'] == 1
+
+
+def test_call_command_failure_within_deadline(bot):
+    def fail(m):
+        raise RuntimeError('failed')
+
+    bot.add_command('/fail', 'fail', fail, timeout=10, fallback='try again later')
+    with pytest.raises(RuntimeError):
+        bot.call_command('/fail', message('/fail'), '')
+    assert bot.deadline_exceeded['/fail'] == 0
@@ -0,0 +1,131 @@
+import asyncio
+
+from delivery import RoomDelivery, MAX_BATCH_LENGTH
+
+
+class Poster:
+    """
+    stand-in for the post coroutine of the bot; records posted messages
+    """
+
+    def __init__(self, delay: float = 0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.posted = []
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, url, json=None, data=None):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError('post failed')
+            self.posted.append(json if json is not None else data)
+            return dict(id=len(self.posted))
+        finally:
+            self.running -= 1
+
+
+def run(test):
+    async def main():
+        return await test(asyncio.get_running_loop())
+
+    return asyncio.run(main())
+
+
+def test_order_within_room():
+    poster = Poster()
+
+    async def test(loop):
+        delivery = RoomDelivery(poster, loop, batch=False)
+        await asyncio.gather(*(delivery.send('room', markdown=str(i)) for i in range(5)))
+        assert delivery.queue_depth == 0
+
+    run(test)
+    assert [m['markdown'] for m in poster.posted] == [str(i) for i in range(5)]
+
+
+def test_rooms_in_parallel():
+    poster = Poster(delay=0.05)
+
+    async def test(loop):
+        delivery = RoomDelivery(poster, loop, batch=False)
+        await asyncio.gather(*(delivery.send(f'room {i}', markdown='x') for i in range(3)),
+                             *(delivery.send(f'room {i}', markdown='y') for i in range(3)))
+
+    run(test)
+    assert len(poster.posted) == 6
+    # one message at a time per room, all rooms at the same time
+    assert poster.max_running == 3
+
+
+def test_batch_markdown_only():
+    poster = Poster()
+
+    async def test(loop):
+        delivery = RoomDelivery(poster, loop)
+        futures = [delivery.send('room', markdown='a'),
+                   delivery.send('room', markdown='b'),
+                   delivery.send('room', markdown='c', files=['https://example.com/c.png']),
+                   delivery.send('room', markdown='d'),
+                   delivery.send('room', markdown='e')]
+        return await asyncio.gather(*futures)
+
+    results = run(test)
+    assert poster.posted == [dict(roomId='room', markdown='a\n\nb'),
+                             dict(roomId='room', markdown='c', files=['https://example.com/c.png']),
+                             dict(roomId='room', markdown='d\n\ne')]
+    # all messages of a batch get the combined message
+    assert [r['id'] for r in results] == [1, 1, 2, 3, 3]
+
+
+def test_batch_length_limit():
+    poster = Poster()
+    text = 'x' * (MAX_BATCH_LENGTH // 3)
+
+    async def test(loop):
+        delivery = RoomDelivery(poster, loop)
+        await asyncio.gather(*(delivery.send('room', markdown=text) for _ in range(4)))
+
+    run(test)
+    assert [m['markdown'].count(text) for m in poster.posted] == [2, 2]
+    assert all(len(m['markdown']) <= MAX_BATCH_LENGTH for m in poster.posted)
+
+
+def test_failed_post_fails_all_batched_futures():
+    poster = Poster(fail=True)
+
+    async def test(loop):
+        delivery = RoomDelivery(poster, loop)
+        futures = [delivery.send('room', markdown=str(i)) for i in range(3)]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    results = run(test)
+    assert len(results) == 3
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_upload_posted_as_form():
+    poster = Poster()
+
+    async def test(loop):
+        delivery = RoomDelivery(poster, loop)
+        await delivery.send('room', markdown='file', files=('a.png', b'content', 'image/png'))
+
+    run(test)
+    assert len(poster.posted) == 1
+    assert not isinstance(poster.posted[0], dict)
+
+
+def test_send_threadsafe():
+    poster = Poster()
+
+    async def test(loop):
+        delivery = RoomDelivery(poster, loop)
+        future = await loop.run_in_executor(None, lambda: delivery.send_threadsafe('room', markdown='x'))
+        return await asyncio.wrap_future(future)
+
+    assert run(test) == dict(id=1)
+    assert poster.posted == [dict(roomId='room', markdown='x')]
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+import aiohttp
+import pytest
+
+from durablequeue import DurableQueue
+
+
+class PausedQueue(DurableQueue):
+    """
+    DurableQueue with a writer thread which only starts working once resumed: all operations submitted before are
+    written in one batch
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.resume = threading.Event()
+        super().__init__(*args, **kwargs)
+
+    def _writer(self) -> None:
+        self.resume.wait()
+        super()._writer()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'messages.db')
+
+
+def test_duplicates(path):
+    q = DurableQueue(path)
+    try:
+        assert q.add('a').result()
+        assert not q.add('a').result()
+        assert q.add('b').result()
+    finally:
+        q.close()
+
+
+def test_pending_after_reopen(path):
+    q = DurableQueue(path)
+    for message_id in 'abc':
+        q.add(message_id)
+    q.done('b')
+    q.close()
+    q = DurableQueue(path)
+    try:
+        assert q.pending().result() == ['a', 'c']
+        # processed messages are still known as duplicates
+        assert not q.add('b').result()
+        q.done('a')
+        q.done('c')
+        assert q.pending().result() == []
+    finally:
+        q.close()
+
+
+def test_failed_batch_is_rolled_back(path):
+    q = PausedQueue(path)
+    try:
+        futures = [q.add('a'), q.add(['not a message id']), q.add('b')]
+        q.resume.set()
+        for f in futures:
+            with pytest.raises(Exception):
+                f.result(timeout=5)
+        # nothing of the failed batch has been committed and the queue keeps working
+        assert q.pending().result() == []
+        assert q.add('a').result()
+        assert q.pending().result() == ['a']
+    finally:
+        q.close()
+
+
+def test_message_left_pending_if_not_obtained(bot, path):
+    q = DurableQueue(path)
+    bot._queue = q
+
+    async def get(url, **kwargs):
+        status = 404 if url.endswith('/deleted') else 500
+        raise aiohttp.ClientResponseError(request_info=None, history=(), status=status)
+
+    bot.get = get
+
+    async def test():
+        assert await bot.ingest('deleted') is None
+        assert await bot.ingest('unavailable') is None
+
+    try:
+        asyncio.run(test())
+        # only the message which doesn't exist is done
+        assert q.pending().result() == ['unavailable']
+    finally:
+        q.close()
@@ -0,0 +1,173 @@
+"""
+Tests of the state backends against MemoryBackend and RedisBackend on a local Redis compatible server (fakeredis)
+"""
+import asyncio
+import threading
+
+import pytest
+
+from statebackend import MemoryBackend, RedisBackend, SharedCache
+from uploadcache import UploadCache
+
+
+def memory_backends():
+    # all instances in the same process share the backend
+    backend = MemoryBackend()
+    return backend, backend
+
+
+def redis_backends():
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    return tuple(RedisBackend(client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+                 for _ in range(2))
+
+
+@pytest.fixture(params=[memory_backends, redis_backends], ids=['memory', 'redis'])
+def backends(request):
+    """
+    function creating the backends of two bot instances; has to be called in the event loop
+    """
+    return request.param
+
+
+def test_leadership(backends):
+    async def test():
+        a, b = backends()
+        assert await a.acquire_leadership('websocket', 'a', ttl=10)
+        assert not await b.acquire_leadership('websocket', 'b', ttl=10)
+        # renew
+        assert await a.acquire_leadership('websocket', 'a', ttl=10)
+        # only the owner can release
+        await b.release_leadership('websocket', 'b')
+        assert not await b.acquire_leadership('websocket', 'b', ttl=10)
+        await a.release_leadership('websocket', 'a')
+        assert await b.acquire_leadership('websocket', 'b', ttl=10)
+        assert not await a.acquire_leadership('websocket', 'a', ttl=10)
+
+    asyncio.run(test())
+
+
+def test_leadership_expires(backends):
+    async def test():
+        a, b = backends()
+        assert await a.acquire_leadership('websocket', 'a', ttl=0.1)
+        await asyncio.sleep(0.2)
+        assert await b.acquire_leadership('websocket', 'b', ttl=10)
+        # the old leader can't renew an expired leadership taken over by someone else
+        assert not await a.acquire_leadership('websocket', 'a', ttl=10)
+
+    asyncio.run(test())
+
+
+def test_work_distribution(backends):
+    async def test():
+        a, b = backends()
+        items = [f'message{i}' for i in range(20)]
+        for item in items:
+            await a.push_work('messages', item)
+        taken = {'a': [], 'b': []}
+
+        async def worker(name, backend):
+            while True:
+                item = await backend.pop_work('messages', timeout=1)
+                if item is None:
+                    return
+                taken[name].append(item)
+                # give the other worker a chance
+                await asyncio.sleep(0)
+
+        await asyncio.gather(worker('a', a), worker('b', b))
+        # each item is taken exactly once and in order by each worker
+        assert sorted(taken['a'] + taken['b']) == sorted(items)
+        for name in taken:
+            assert taken[name] == sorted(taken[name], key=items.index)
+
+    asyncio.run(test())
+
+
+def test_pop_work_timeout(backends):
+    async def test():
+        a, _ = backends()
+        assert await a.pop_work('empty', timeout=0.1) is None
+
+    asyncio.run(test())
+
+
+def test_add_once(backends):
+    async def test():
+        a, b = backends()
+        assert await a.add_once('message1', ttl=10)
+        assert not await a.add_once('message1', ttl=10)
+        # seen by the other instance as well
+        assert not await b.add_once('message1', ttl=10)
+        assert await b.add_once('message2', ttl=10)
+
+    asyncio.run(test())
+
+
+def test_add_once_expires(backends):
+    async def test():
+        a, _ = backends()
+        assert await a.add_once('message1', ttl=0.1)
+        await asyncio.sleep(0.2)
+        assert await a.add_once('message1', ttl=10)
+
+    asyncio.run(test())
+
+
+def test_cache(backends):
+    async def test():
+        a, b = backends()
+        assert await b.cache_get('key') is None
+        await a.cache_set('key', 'value', ttl=10)
+        assert await b.cache_get('key') == 'value'
+        # cache and duplicate detection don't share keys
+        assert await a.add_once('key', ttl=10)
+        assert await a.cache_get('key') == 'value'
+
+    asyncio.run(test())
+
+
+def test_cache_mixed_ttls(backends):
+    async def test():
+        a, _ = backends()
+        await a.cache_set('long', 'x', ttl=1000)
+        await a.cache_set('short', 'y', ttl=0.05)
+        await asyncio.sleep(0.1)
+        assert await a.cache_get('short') is None
+        assert await a.cache_get('long') == 'x'
+        # setting a key again extends its lifetime
+        await a.cache_set('again', 'z', ttl=0.05)
+        await a.cache_set('again', 'z', ttl=1000)
+        await asyncio.sleep(0.1)
+        assert await a.cache_get('again') == 'z'
+
+    asyncio.run(test())
+
+
+def test_shared_upload_cache(backends):
+    async def test():
+        a, b = backends()
+        loop = asyncio.get_running_loop()
+        cache_a, cache_b = UploadCache(), UploadCache()
+        cache_a.share(SharedCache(a, loop))
+        cache_b.share(SharedCache(b, loop))
+        digest = UploadCache.digest(b'image')
+        assert await cache_b.lookup_async('room', digest) is None
+        cache_a.remember('room', digest, 'message1')
+        # writes happen in the background
+        await asyncio.sleep(0.05)
+        assert await cache_b.lookup_async('room', digest) == 'message1'
+        assert await cache_b.lookup_async('other room', digest) is None
+
+        # lookup() from a thread
+        result = []
+        thread = threading.Thread(target=lambda: result.append(cache_b.lookup('room', digest)))
+        thread.start()
+        while thread.is_alive():
+            await asyncio.sleep(0.01)
+        assert result == ['message1']
+        assert (cache_b.hits, cache_b.misses) == (2, 2)
+
+    asyncio.run(test())
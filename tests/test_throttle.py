@@ -0,0 +1,40 @@
+import pytest
+
+from throttle import SlidingWindowLimiter, Throttle
+
+
+def test_sliding_window():
+    limiter = SlidingWindowLimiter(limit=5, window=10)
+    for _ in range(5):
+        assert limiter.check('user', 1, now=0) is None
+        limiter.add('user', 1, now=0)
+    assert limiter.check('user', 1, now=0) == 10
+    # half of the previous window still counts: 2.5
+    assert limiter.check('user', 2, now=15) is None
+    assert limiter.check('user', 3, now=15) == 5
+    # previous window is outdated
+    assert limiter.check('user', 5, now=30) is None
+
+
+def test_concurrency():
+    throttle = Throttle(user_rate=None, room_rate=None, user_concurrency=1, room_concurrency=None)
+    assert throttle.acquire('user', 'room') is None
+    assert throttle.acquire('user', 'room') is not None
+    assert throttle.acquire('other user', 'room') is None
+    throttle.release('user', 'room')
+    assert throttle.acquire('user', 'room') is None
+    assert throttle.throttled == 1
+
+
+def test_cost_above_limit():
+    throttle = Throttle(user_rate=(5, 60), room_rate=(30, 60))
+    throttle.check_cost(5)
+    with pytest.raises(ValueError):
+        throttle.check_cost(7)
+
+
+def test_notify_once():
+    throttle = Throttle()
+    assert throttle.should_notify('user')
+    assert not throttle.should_notify('user')
+    assert throttle.should_notify('other user')
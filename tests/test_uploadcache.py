@@ -0,0 +1,23 @@
+import asyncio
+
+from uploadcache import UploadCache
+
+
+def test_async_upload_slots():
+    cache = UploadCache(max_uploads_per_room=2)
+    running = {'room 1': 0, 'room 2': 0}
+    most = {'room 1': 0, 'room 2': 0}
+
+    async def upload(room_id):
+        async with cache.upload_slot_async(room_id):
+            running[room_id] += 1
+            most[room_id] = max(most[room_id], running[room_id])
+            await asyncio.sleep(0.01)
+            running[room_id] -= 1
+
+    async def test():
+        await asyncio.gather(*(upload(room_id) for room_id in running for _ in range(5)))
+
+    asyncio.run(test())
+    assert most == {'room 1': 2, 'room 2': 2}
+
@@ -0,0 +1,157 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+from typing import Optional, Dict, Tuple, Hashable
+
+log = logging.getLogger(__name__)
+
+
+class SlidingWindowLimiter:
+    """
+    Rate limit per key using sliding window counters: the rate is estimated from the counts of the current and the
+    previous fixed window, weighted by the overlap of the previous window with the sliding window. That's 3 numbers per
+    key; the number of keys is bounded, keys not used for the longest time are dropped first.
+    Not thread safe; see Throttle.
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = 10000) -> None:
+        """
+        :param limit: maximum cost per window
+        :param window: window in seconds
+        :param max_keys: maximum number of keys to keep track of
+        """
+        self.limit = limit
+        self.window = window
+        self._max_keys = max_keys
+        # key -> (start of current window, count in previous window, count in current window)
+        self._counters: 'OrderedDict[Hashable, Tuple[float, int, int]]' = OrderedDict()
+
+    def _current(self, key: Hashable, now: float) -> Tuple[float, int, int]:
+        start, previous, current = self._counters.get(key, (now, 0, 0))
+        if now - start >= 2 * self.window:
+            # both windows are outdated
+            return now - (now - start) % self.window, 0, 0
+        if now - start >= self.window:
+            return start + self.window, current, 0
+        return start, previous, current
+
+    def check(self, key: Hashable, cost: int, now: float) -> Optional[float]:
+        """
+        Check whether a call with the given cost is allowed
+        :return: None if allowed, else time in seconds after which the call might be allowed
+        """
+        start, previous, current = self._current(key, now)
+        estimate = previous * (1 - (now - start) / self.window) + current
+        if estimate + cost <= self.limit:
+            return None
+        return start + self.window - now
+
+    def add(self, key: Hashable, cost: int, now: float) -> None:
+        start, previous, current = self._current(key, now)
+        self._counters[key] = (start, previous, current + cost)
+        self._counters.move_to_end(key)
+        while len(self._counters) > self._max_keys:
+            self._counters.popitem(last=False)
+
+
+class Throttle:
+    """
+    Per user and per room rate limits and concurrency caps for bot commands. Thread safe.
+    """
+
+    def __init__(self,
+                 user_rate: Optional[Tuple[int, float]] = (10, 60),
+                 room_rate: Optional[Tuple[int, float]] = (30, 60),
+                 user_concurrency: Optional[int] = 2,
+                 room_concurrency: Optional[int] = 4,
+                 max_keys: int = 10000) -> None:
+        """
+        :param user_rate: (limit, window in seconds) for the cost of commands per user; None: no limit
+        :param room_rate: (limit, window in seconds) for the cost of commands per room; None: no limit
+        :param user_concurrency: maximum number of commands in flight per user; None: no limit
+        :param room_concurrency: maximum number of commands in flight per room; None: no limit
+        :param max_keys: maximum number of users/rooms to keep track of
+        """
+        self._lock = threading.Lock()
+        self._user_rate = user_rate and SlidingWindowLimiter(*user_rate, max_keys=max_keys)
+        self._room_rate = room_rate and SlidingWindowLimiter(*room_rate, max_keys=max_keys)
+        self._user_concurrency = user_concurrency
+        self._room_concurrency = room_concurrency
+        # ('user', id) or ('room', id) -> number of commands in flight; only keys w/ commands in flight are kept
+        self._in_flight: Dict[Tuple[str, str], int] = {}
+        # users which have been told to wait: user -> time until which we don't tell them again
+        self._notified: 'OrderedDict[str, float]' = OrderedDict()
+        self._max_keys = max_keys
+        self.throttled = 0
+
+    def check_cost(self, cost: int) -> None:
+        """
+        Make sure that a command with the given cost can ever be allowed
+        :param cost: cost of the command
+        :raises ValueError: cost exceeds the user or room rate limit
+        """
+        for limiter in (self._user_rate, self._room_rate):
+            if limiter and cost > limiter.limit:
+                raise ValueError(f'cost {cost} exceeds the rate limit of {limiter.limit} per {limiter.window} seconds')
+
+    def acquire(self, user: str, room: str, cost: int = 1) -> Optional[float]:
+        """
+        Check limits for a command and count the command if allowed. Each successful acquire() has to be followed by a
+        release() once the command is done
+        :param user: user id
+        :param room: room id
+        :param cost: cost of the command
+        :return: None if allowed, else time in seconds after which the user can try again
+        """
+        now = time.monotonic()
+        with self._lock:
+            retry = 0.0
+            for limiter, key in ((self._user_rate, user), (self._room_rate, room)):
+                if limiter:
+                    wait = limiter.check(key, cost, now)
+                    if wait is not None:
+                        retry = max(retry, wait)
+            for cap, key in ((self._user_concurrency, ('user', user)), (self._room_concurrency, ('room', room))):
+                if cap is not None and self._in_flight.get(key, 0) >= cap:
+                    # no idea how long the commands in flight take; try again in a second
+                    retry = max(retry, 1.0)
+            if retry:
+                self.throttled += 1
+                return retry
+            for limiter, key in ((self._user_rate, user), (self._room_rate, room)):
+                if limiter:
+                    limiter.add(key, cost, now)
+            for key in (('user', user), ('room', room)):
+                self._in_flight[key] = self._in_flight.get(key, 0) + 1
+        return None
+
+    def release(self, user: str, room: str) -> None:
+        """
+        A command allowed by acquire() is done
+        """
+        with self._lock:
+            for key in (('user', user), ('room', room)):
+                count = self._in_flight.get(key, 0) - 1
+                if count > 0:
+                    self._in_flight[key] = count
+                else:
+                    self._in_flight.pop(key, None)
+
+    def should_notify(self, user: str, interval: float = 60) -> bool:
+        """
+        Tell a throttled user to wait at most once per interval
+        :param user: user id
+        :param interval: interval in seconds
+        :return: True if the user should be notified
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._notified.get(user, 0) > now:
+                return False
+            self._notified[user] = now + interval
+            self._notified.move_to_end(user)
+            while len(self._notified) > self._max_keys:
+                self._notified.popitem(last=False)
+        return True
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import hashlib
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+
+from typing import Optional, Dict, Tuple, Union
+
+from statebackend import SharedCache
+
+log = logging.getLogger(__name__)
+
+
+class UploadCache:
+    """
+    Remember files recently posted to a space so that repeated posts of the same content can be replaced by a light
+    weight reference to the earlier message. Also caps the number of concurrent uploads per space.
+
+    The Webex API has no way to attach a file of an existing message to a new message; the best we can do for repeated
+    content is to post a threaded reply (parentId) to the message which already carries the file.
+
+    With multiple bot instances posted files are also recorded in a shared cache (see share()) so that an instance can
+    reference files posted by other instances.
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 1024, max_uploads_per_room: int = 2) -> None:
+        """
+        :param ttl: time in seconds for which a posted file can be referenced instead of being uploaded again
+        :param max_entries: maximum number of (room, content) entries to remember
+        :param max_uploads_per_room: maximum number of concurrent uploads to a single room
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._max_uploads_per_room = max_uploads_per_room
+        self._lock = threading.Lock()
+        # (room id, digest) -> (message id, time posted); oldest entries first
+        self._posted: 'OrderedDict[Tuple[str, str], Tuple[str, float]]' = OrderedDict()
+        self._room_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._async_room_slots: Dict[str, asyncio.Semaphore] = {}
+        self._shared: Optional[SharedCache] = None
+        self.hits = 0
+        self.misses = 0
+
+    def share(self, shared: Optional[SharedCache]) -> None:
+        """
+        Record posted files in a shared cache and look up files not posted by this instance there
+        :param shared: shared cache; None to stop sharing
+        """
+        self._shared = shared
+
+    @staticmethod
+    def digest(content: Union[bytes, str]) -> str:
+        """
+        Key for a file. For local content this is a hash of the actual bytes. For files posted by URL Webex fetches the
+        file itself; we never see the bytes. The URL can only be used as content identity if the content behind the URL
+        never changes
+        :param content: file content or URL
+        :return: hex digest
+        """
+        if isinstance(content, str):
+            content = content.encode('utf8')
+        return hashlib.sha256(content).hexdigest()
+
+    def _lookup_local(self, room_id: str, digest: str) -> Optional[str]:
+        key = (room_id, digest)
+        with self._lock:
+            entry = self._posted.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self._ttl:
+                del self._posted[key]
+                entry = None
+            return None if entry is None else entry[0]
+
+    def _count(self, message_id: Optional[str]) -> None:
+        with self._lock:
+            if message_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    @staticmethod
+    def _shared_key(room_id: str, digest: str) -> str:
+        return f'upload:{room_id}:{digest}'
+
+    def lookup(self, room_id: str, digest: str) -> Optional[str]:
+        """
+        Get the id of a message which recently posted the given content to a room. Not to be called from the event loop
+        if the cache is shared; use lookup_async() there
+        :param room_id: room id
+        :param digest: content digest
+        :return: message id or None
+        """
+        message_id = self._lookup_local(room_id, digest)
+        if message_id is None and self._shared is not None:
+            message_id = self._shared.get(self._shared_key(room_id, digest))
+        self._count(message_id)
+        return message_id
+
+    async def lookup_async(self, room_id: str, digest: str) -> Optional[str]:
+        """
+        Same as lookup(); to be called from the event loop
+        """
+        message_id = self._lookup_local(room_id, digest)
+        if message_id is None and self._shared is not None:
+            message_id = await self._shared.get_async(self._shared_key(room_id, digest))
+        self._count(message_id)
+        return message_id
+
+    def remember(self, room_id: str, digest: str, message_id: str) -> None:
+        """
+        Record that a message with the given content has been posted to a room
+        :param room_id: room id
+        :param digest: content digest
+        :param message_id: id of the message carrying the file
+        """
+        key = (room_id, digest)
+        with self._lock:
+            self._posted[key] = (message_id, time.monotonic())
+            self._posted.move_to_end(key)
+            while len(self._posted) > self._max_entries:
+                self._posted.popitem(last=False)
+        if self._shared is not None:
+            self._shared.set(self._shared_key(room_id, digest), message_id, self._ttl)
+
+    @contextmanager
+    def upload_slot(self, room_id: str):
+        """
+        Context manager limiting the number of concurrent uploads to a room
+        :param room_id: room id
+        """
+        with self._lock:
+            slot = self._room_slots.get(room_id)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self._max_uploads_per_room)
+                self._room_slots[room_id] = slot
+        with slot:
+            yield
+
+    @asynccontextmanager
+    async def upload_slot_async(self, room_id: str):
+        """
+        Same as upload_slot(); to be used in the event loop
+        :param room_id: room id
+        """
+        slot = self._async_room_slots.get(room_id)
+        if slot is None:
+            slot = asyncio.Semaphore(self._max_uploads_per_room)
+            self._async_room_slots[room_id] = slot
+        async with slot:
+            yield